@@ -27,6 +27,14 @@ UA_LONG = "OverDrive Media Console/3.7.0.28 iOS/10.3.3"
 
 PERFORMER_FID = b"TPE3"
 LANGUAGE_FID = b"TLAN"
+# element id of the top-level CTOC frame
+TOC_ELEMENT_ID = b"toc"
+
+# read/write buffer sizes for streamed downloads
+PART_COPY_BUFFER_SIZE = 1024 * 1024
+LICENSE_CHUNK_SIZE = 64 * 1024
+# enough to hold the first mp3 frame with its Xing/LAME header
+MP3_HEADER_INSPECT_SIZE = 4 * 1024
 
 # Ref: https://github.com/ping/odmpy/issues/19
 UNSUPPORTED_PARSER_ENTITIES = {
@@ -15,28 +15,34 @@
 # You should have received a copy of the GNU General Public License
 # along with odmpy.  If not, see <http://www.gnu.org/licenses/>.
 #
+import copy
 import json
 import logging
+import os
 import re
 import sys
-from collections import OrderedDict
+import time
 from datetime import datetime, timezone
 from enum import Enum
 from pathlib import Path
 from typing import Optional, NamedTuple, Dict, List, Tuple
-from typing import OrderedDict as OrderedDictType
-from urllib import request
 from urllib.parse import urljoin
 
-
 if sys.version_info >= (3, 8):
     from typing import TypedDict
 else:
     from typing_extensions import TypedDict
 import requests
+import urllib3
 from requests.adapters import HTTPAdapter, Retry
 
-from .libby_errors import ClientConnectionError, ClientTimeoutError, ErrorHandler
+from .utils import json_loads
+from .libby_errors import (
+    ClientConnectionError,
+    ClientError,
+    ClientTimeoutError,
+    ErrorHandler,
+)
 
 #
 # Client for the Libby web API, and helper functions to make sense
@@ -62,6 +68,14 @@ PartMeta = TypedDict(
         "spine-position": int,
     },
 )
+# default values for a new PartMeta, copy this and set a fresh "chapters" list
+_EMPTY_PART_META: PartMeta = {
+    "chapters": [],
+    "url": "",
+    "audio-duration": 0,
+    "file-length": 0,
+    "spine-position": 0,
+}
 
 
 class LibbyFormats(str, Enum):
@@ -97,26 +111,68 @@ class LibbyMediaTypes(str, Enum):
         return str(self.value)
 
 
-FILE_PART_RE = re.compile(
-    r"(?P<part_name>{[A-F0-9\-]{36}}[^#]+)(#(?P<second_stamp>\d+(\.\d+)?))?$"
+# Plain interned str ids for the format checks against the ids from the API,
+# so that the comparisons do not have to go through the str-based enum.
+AUDIOBOOK_MP3_ID = sys.intern(LibbyFormats.AudioBookMP3.value)
+EBOOK_EPUB_OPEN_ID = sys.intern(LibbyFormats.EBookEPubOpen.value)
+MAGAZINE_OVERDRIVE_ID = sys.intern(LibbyFormats.MagazineOverDrive.value)
+
+# The order determines the format selected for a loan.
+# The "open" version of the format (example open epub, open pdf) should be prioritised.
+_FORMAT_PRIORITY = (
+    LibbyFormats.AudioBookMP3,
+    LibbyFormats.EBookEPubOpen,
+    LibbyFormats.MagazineOverDrive,
+    LibbyFormats.EBookEPubAdobe,
+    LibbyFormats.EBookPDFOpen,
+    LibbyFormats.EBookPDFAdobe,
+)
+_FORMAT_PRIORITY_NO_OPEN = tuple(
+    f
+    for f in _FORMAT_PRIORITY
+    if f not in (LibbyFormats.EBookEPubOpen, LibbyFormats.EBookPDFOpen)
+)
+
+# groups: 1 - part_name, 2 - second_stamp
+FILE_PART_RE = re.compile(r"(\{[A-F0-9\-]{36}\}[^#]+)(?:#(\d+(?:\.\d+)?))?$")
+BDATA_RE = re.compile(rb"window\.bData\s*=\s*")
+BDATA_MARKER = b"window.bData"
+# spine paths that urljoin() would not leave as is after the base directory:
+# whitespace/control chars, fragments, params, absolute or dot paths, empty queries
+URLJOIN_PATH_RE = re.compile(r"[\x00-\x20#;]|^[/?.]|^$|\?$")
+# ISO 8601 timestamps that fromisoformat() parses the same as the strptime formats
+# in LibbyClient.parse_datetime(), on all supported python versions
+ISO_DATETIME_RE = re.compile(
+    r"[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}"
+    r"(?:\.[0-9]{3}|\.[0-9]{6})?(?:Z|[+-][0-9]{2}:[0-9]{2})"
 )
 USER_AGENT = (
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 11_1) AppleWebKit/605.1.15 (KHTML, like Gecko) "
     "Version/14.0.2 Safari/605.1.15"
 )
-EBOOK_DOWNLOADABLE_FORMATS = (
-    LibbyFormats.EBookEPubAdobe,
-    LibbyFormats.EBookEPubOpen,
-    LibbyFormats.EBookPDFAdobe,
-    LibbyFormats.EBookPDFOpen,
+# static part of the default HTTP headers, see `LibbyClient.default_headers()`
+_DEFAULT_HEADERS = {
+    "Accept": "application/json",
+    "Cache-Control": "no-cache",
+    "Pragma": "no-cache",
+}
+EBOOK_DOWNLOADABLE_FORMATS = frozenset(
+    {
+        LibbyFormats.EBookEPubAdobe,
+        LibbyFormats.EBookEPubOpen,
+        LibbyFormats.EBookPDFAdobe,
+        LibbyFormats.EBookPDFOpen,
+    }
 )
-DOWNLOADABLE_FORMATS = (
-    LibbyFormats.AudioBookMP3,
-    LibbyFormats.EBookEPubAdobe,
-    LibbyFormats.EBookEPubOpen,
-    LibbyFormats.EBookPDFAdobe,
-    LibbyFormats.EBookPDFOpen,
-    LibbyFormats.MagazineOverDrive,
+DOWNLOADABLE_FORMATS = frozenset(
+    {
+        LibbyFormats.AudioBookMP3,
+        LibbyFormats.EBookEPubAdobe,
+        LibbyFormats.EBookEPubOpen,
+        LibbyFormats.EBookPDFAdobe,
+        LibbyFormats.EBookPDFOpen,
+        LibbyFormats.MagazineOverDrive,
+    }
 )
 
 
@@ -133,19 +189,13 @@ def parse_part_path(title: str, part_path: str) -> ChapterMarker:
     mobj = FILE_PART_RE.match(part_path)
     if not mobj:
         raise ValueError(f"Unexpected path format: {part_path}")
+    part_name, second_stamp = mobj.groups()
     return ChapterMarker(
-        title=title,
-        part_name=mobj.group("part_name"),
-        start_second=(
-            float(mobj.group("second_stamp")) if mobj.group("second_stamp") else 0
-        ),
-        end_second=0,
+        title, part_name, float(second_stamp) if second_stamp else 0, 0
     )
 
 
-def parse_toc(
-    base_url: str, toc: List[Dict], spine: List[Dict]
-) -> OrderedDictType[str, PartMeta]:
+def parse_toc(base_url: str, toc: List[Dict], spine: List[Dict]) -> Dict[str, PartMeta]:
     """
     Parses `openbook["nav"]["toc"]` and `openbook["spine"]` to a format
     suitable for processing.
@@ -163,54 +213,54 @@ def parse_toc(
             # so that we can de-dup these entries later
             entries.append(parse_part_path(item["title"], content["path"]))
 
-    # use an OrderedDict to ensure that we can consistently test this
-    parsed_toc: OrderedDictType[str, PartMeta] = OrderedDict()
+    # dicts preserve insertion order, so the parts stay in toc order
+    parsed_toc: Dict[str, PartMeta] = {}
 
+    # last chapter title added for each part_name
+    last_titles: Dict[str, str] = {}
     for entry in entries:
         if entry.part_name not in parsed_toc:
-            parsed_toc[entry.part_name] = {
-                "chapters": [],
-                "url": "",
-                "audio-duration": 0,
-                "file-length": 0,
-                "spine-position": 0,
-            }
-        if not parsed_toc[entry.part_name]["chapters"]:
-            # first entry for the part_name
-            parsed_toc[entry.part_name]["chapters"].append(entry)
-            continue
+            part_meta = _EMPTY_PART_META.copy()
+            part_meta["chapters"] = []
+            parsed_toc[entry.part_name] = part_meta
         # de-dup entries because OD sometimes generates timestamped chapter titles marks
         # for the same chapter in the same part, e.g. "Chapter 2 (00:00)", "Chapter 2 (12:34)"
-        if entry.title == parsed_toc[entry.part_name]["chapters"][-1].title:
+        if last_titles.get(entry.part_name) == entry.title:
             continue
         parsed_toc[entry.part_name]["chapters"].append(entry)
+        last_titles[entry.part_name] = entry.title
 
+    # urljoin() re-parses base_url for every spine entry, so plain relative
+    # paths (the usual case) are resolved against the base directory directly
+    base_dir = urljoin(base_url, ".") if base_url else ""
     for s in spine:
-        parsed_toc[s["-odread-original-path"]].update(
-            {
-                "url": urljoin(base_url, s["path"]),
-                "audio-duration": s["audio-duration"],
-                "file-length": s["-odread-file-bytes"],
-                "spine-position": s["-odread-spine-position"],
-            }
-        )
+        path = s["path"]
+        path_head = path.split("?", 1)[0]
+        if (
+            URLJOIN_PATH_RE.search(path)
+            or ":" in path_head
+            or "/." in path_head
+            or "//" in path_head
+        ):
+            url = urljoin(base_url, path)
+        else:
+            url = base_dir + path
+        part_meta = parsed_toc[s["-odread-original-path"]]
+        part_meta["url"] = url
+        part_meta["audio-duration"] = s["audio-duration"]
+        part_meta["file-length"] = s["-odread-file-bytes"]
+        part_meta["spine-position"] = s["-odread-spine-position"]
     for chapter_mark in parsed_toc.values():  # type: PartMeta
         chapters = chapter_mark["chapters"]
-        updated_chapters = []
-        for i, chapter in enumerate(chapters):
-            # update end_second mark
-            updated_chapter = ChapterMarker(
-                title=chapter.title,
-                part_name=chapter.part_name,
-                start_second=chapter.start_second,
-                end_second=(
-                    chapters[i + 1].start_second
-                    if i < (len(chapters) - 1)
-                    else chapter_mark["audio-duration"]
-                ),
+        # a chapter ends where the next one starts, or at the end of the part
+        end_seconds = [c.start_second for c in chapters[1:]]
+        end_seconds.append(chapter_mark["audio-duration"])
+        chapter_mark["chapters"] = [
+            ChapterMarker(title, part_name, start_second, end_second)
+            for (title, part_name, start_second, _), end_second in zip(
+                chapters, end_seconds
             )
-            updated_chapters.append(updated_chapter)
-        chapter_mark["chapters"] = updated_chapters
+        ]
 
     return parsed_toc
 
@@ -222,26 +272,22 @@ def merge_toc(toc: Dict) -> List[ChapterMarker]:
     :param toc: parsed toc
     :return:
     """
-    chapters = OrderedDict()
-    parts = list(toc.values())
-    for i, part in enumerate(parts):
-        cumu_part_duration = sum([p["audio-duration"] for p in parts[:i]])
+    # title -> [start, end]
+    chapters: Dict[str, List[float]] = {}
+    cumu_part_duration = 0.0
+    for part in toc.values():
         for marker in part["chapters"]:
-            if marker.title not in chapters:
-                chapters[marker.title] = {
-                    "start": cumu_part_duration + marker.start_second,
-                    "end": 0,
-                }
-            chapters[marker.title]["end"] = cumu_part_duration + marker.end_second
+            start_end = chapters.get(marker.title)
+            if start_end is None:
+                start_end = chapters[marker.title] = [
+                    cumu_part_duration + marker.start_second,
+                    0,
+                ]
+            start_end[1] = cumu_part_duration + marker.end_second
+        cumu_part_duration += part["audio-duration"]
 
     return [
-        ChapterMarker(
-            title=title,
-            part_name="",
-            start_second=marker["start"],
-            end_second=marker["end"],
-        )
-        for title, marker in list(chapters.items())
+        ChapterMarker(title, "", start, end) for title, (start, end) in chapters.items()
     ]
 
 
@@ -280,17 +326,40 @@ class LibbyClient(object):
             if not self.identity.get("__libby_sync_code"):
                 self.identity["__libby_sync_code"] = self.identity["__odmpy_sync_code"]
             del self.identity["__odmpy_sync_code"]
-            with self.identity_settings_file.open("w", encoding="utf-8") as f:
-                json.dump(self.identity, f)
+            self._write_settings()
 
         self.max_retries = max_retries
+        self.user_agent = kwargs.pop("user_agent", USER_AGENT)
         libby_session = requests.Session()
-        adapter = HTTPAdapter(max_retries=Retry(total=max_retries, backoff_factor=0.1))
+        # most requests go to the same few hosts, so keep more connections
+        # alive per host instead of re-doing the TCP/TLS handshake
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=32,
+            pool_block=False,
+            max_retries=Retry(total=max_retries, backoff_factor=0.1),
+        )
         for prefix in ("http://", "https://"):
             libby_session.mount(prefix, adapter)
         self.libby_session = libby_session
-        self.user_agent = kwargs.pop("user_agent", USER_AGENT)
+        # for the open epub/pdf downloads, see `_urlretrieve()`
+        self.cdn_pool = urllib3.PoolManager(
+            num_pools=4,
+            maxsize=8,
+            retries=Retry(
+                total=None,
+                connect=max_retries,
+                read=max_retries,
+                redirect=10,
+                backoff_factor=0.1,
+                remove_headers_on_redirect=[],
+            ),
+        )
         self.api_base = "https://sentry-read.svc.overdrive.com/"
+        # cache the sync response briefly so that consecutive calls to
+        # get_loans(), get_holds(), etc. do not each make a round-trip
+        self._sync_ttl: float = kwargs.pop("sync_ttl", 5.0)
+        self._sync_cache: Optional[Tuple[float, Dict]] = None
 
     @staticmethod
     def is_valid_sync_code(code: str) -> bool:
@@ -302,12 +371,9 @@ class LibbyClient(object):
 
         :return:
         """
-        return {
-            "User-Agent": self.user_agent,
-            "Accept": "application/json",
-            "Cache-Control": "no-cache",
-            "Pragma": "no-cache",
-        }
+        headers = _DEFAULT_HEADERS.copy()
+        headers["User-Agent"] = self.user_agent
+        return headers
 
     def make_request(
         self,
@@ -321,6 +387,7 @@ class LibbyClient(object):
         session: Optional[requests.sessions.Session] = None,
         return_res: bool = False,
         allow_redirects: bool = True,
+        stream: bool = False,
     ):
         endpoint_url = urljoin(self.api_base, endpoint)
         if not method:
@@ -331,28 +398,29 @@ class LibbyClient(object):
                 method = "GET"
         if headers is None:
             headers = self.default_headers()
-        if authenticated and self.get_token():
-            headers["Authorization"] = f"Bearer {self.get_token()}"
+        token = self.get_token() if authenticated else None
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
 
-        req = requests.Request(
-            method,
-            endpoint_url,
-            headers=headers,
-            params=params,
-            data=data,
-            json=json_data,
-        )
         if not session:
             # default session
             session = self.libby_session
 
         try:
-            res = session.send(
-                session.prepare_request(req),
+            res = session.request(
+                method,
+                endpoint_url,
+                headers=headers,
+                params=params,
+                data=data,
+                json=json_data,
                 timeout=self.timeout,
                 allow_redirects=allow_redirects,
+                stream=stream,
             )
-            self.logger.debug("body: %s", res.text)
+            if not stream:
+                # don't consume the body for streamed responses
+                self.logger.debug("body: %s", res.text)
 
             res.raise_for_status()
             if return_res:
@@ -377,8 +445,20 @@ class LibbyClient(object):
             raise ValueError(
                 "Unable to save settings because settings_folder is not defined"
             )
-        with open(self.identity_settings_file, "w", encoding="utf-8") as f:
-            json.dump(self.identity, f)
+        self._write_settings()
+
+    def _write_settings(self) -> None:
+        """
+        Write identity settings to file in a single write, via a temp file
+        so that an interrupted save does not leave a truncated file behind.
+
+        :return:
+        """
+        if not self.identity_settings_file:
+            return
+        tmp_file = self.identity_settings_file.with_suffix(".json.tmp")
+        tmp_file.write_bytes(json.dumps(self.identity).encode("utf-8"))
+        os.replace(tmp_file, self.identity_settings_file)
 
     def clear_settings(self) -> None:
         """
@@ -389,6 +469,7 @@ class LibbyClient(object):
         if self.identity_settings_file and self.identity_settings_file.exists():
             self.identity_settings_file.unlink()
         self.identity = {}
+        self._sync_cache = None
 
     def has_chip(self) -> bool:
         """
@@ -423,6 +504,7 @@ class LibbyClient(object):
             method="POST",
             authenticated=authenticated,
         )
+        self._sync_cache = None
         if auto_save:
             # persist to settings
             self.save_settings(res)
@@ -443,6 +525,7 @@ class LibbyClient(object):
             raise ValueError(f"Invalid code: {code}")
 
         res: Dict = self.make_request("chip/clone/code", data={"code": code})
+        self._sync_cache = None
         if auto_save:
             # persist to settings
             self.save_settings({"__libby_sync_code": code})
@@ -451,11 +534,19 @@ class LibbyClient(object):
     def sync(self) -> Dict:
         """
         Get the user account state, which includes loans, holds, etc.
+        The response is cached for a few seconds and invalidated by calls
+        that change the account state.
 
         :return:
         """
+        if self._sync_cache:
+            cached_at, cached_res = self._sync_cache
+            if time.monotonic() - cached_at < self._sync_ttl:
+                return copy.deepcopy(cached_res)
         res: Dict = self.make_request("chip/sync")
-        return res
+        self._sync_cache = (time.monotonic(), res)
+        # callers get their own copy so that changes to it do not leak into the cache
+        return copy.deepcopy(res)
 
     def auth_form(self, website_id) -> Dict:
         """
@@ -484,6 +575,7 @@ class LibbyClient(object):
         res: Dict = self.make_request(
             f"auth/link/{website_id}", json_data=data, method="POST"
         )
+        self._sync_cache = None
         return res
 
     def update_card_name(self, card_id: str, card_name: str) -> Dict:
@@ -497,6 +589,7 @@ class LibbyClient(object):
         res: Dict = self.make_request(
             f"card/{card_id}", params={"card_name": card_name}, method="PUT"
         )
+        self._sync_cache = None
         return res
 
     def is_logged_in(self) -> bool:
@@ -518,9 +611,7 @@ class LibbyClient(object):
         :param book:
         :return:
         """
-        return bool(
-            [f for f in book.get("formats", []) if f["id"] == LibbyFormats.AudioBookMP3]
-        )
+        return any(f["id"] == AUDIOBOOK_MP3_ID for f in book.get("formats", []))
 
     @staticmethod
     def is_downloadable_ebook_loan(book: Dict) -> bool:
@@ -530,12 +621,8 @@ class LibbyClient(object):
         :param book:
         :return:
         """
-        return bool(
-            [
-                f
-                for f in book.get("formats", [])
-                if f["id"] in EBOOK_DOWNLOADABLE_FORMATS
-            ]
+        return any(
+            f["id"] in EBOOK_DOWNLOADABLE_FORMATS for f in book.get("formats", [])
         )
 
     @staticmethod
@@ -546,24 +633,17 @@ class LibbyClient(object):
         :param book:
         :return:
         """
-        return bool(
-            [
-                f
-                for f in book.get("formats", [])
-                if f["id"] == LibbyFormats.MagazineOverDrive
-            ]
-        )
+        return any(f["id"] == MAGAZINE_OVERDRIVE_ID for f in book.get("formats", []))
 
     @staticmethod
     def has_format(loan: Dict, format_id: str) -> bool:
-        return bool(
-            next(iter([f["id"] for f in loan["formats"] if f["id"] == format_id]), None)
-        )
+        format_id = str(format_id)
+        return any(f["id"] == format_id for f in loan["formats"])
 
     @staticmethod
     def get_loan_format(loan: Dict, prefer_open_format: bool = True) -> str:
         locked_in_format = next(
-            iter([f["id"] for f in loan["formats"] if f.get("isLockedIn")]), None
+            (f["id"] for f in loan["formats"] if f.get("isLockedIn")), None
         )
         if locked_in_format:
             if locked_in_format in DOWNLOADABLE_FORMATS:
@@ -572,38 +652,12 @@ class LibbyClient(object):
                 f'Loan is locked to a non-downloadable format "{locked_in_format}"'
             )
 
-        if not locked_in_format:
-            # the order of these checks will determine the output format
-            # the "open" version of the format (example open epub, open pdf) should
-            # be prioritised
-            if LibbyClient.is_downloadable_audiobook_loan(
-                loan
-            ) and LibbyClient.has_format(loan, LibbyFormats.AudioBookMP3):
-                return LibbyFormats.AudioBookMP3
-            elif (
-                LibbyClient.is_open_ebook_loan(loan)
-                and LibbyClient.has_format(loan, LibbyFormats.EBookEPubOpen)
-                and prefer_open_format
-            ):
-                return LibbyFormats.EBookEPubOpen
-            elif LibbyClient.is_downloadable_magazine_loan(
-                loan
-            ) and LibbyClient.has_format(loan, LibbyFormats.MagazineOverDrive):
-                return LibbyFormats.MagazineOverDrive
-            elif LibbyClient.is_downloadable_ebook_loan(
-                loan
-            ) and LibbyClient.has_format(loan, LibbyFormats.EBookEPubAdobe):
-                return LibbyFormats.EBookEPubAdobe
-            elif (
-                LibbyClient.is_downloadable_ebook_loan(loan)
-                and LibbyClient.has_format(loan, LibbyFormats.EBookPDFOpen)
-                and prefer_open_format
-            ):
-                return LibbyFormats.EBookPDFOpen
-            elif LibbyClient.is_downloadable_ebook_loan(
-                loan
-            ) and LibbyClient.has_format(loan, LibbyFormats.EBookPDFAdobe):
-                return LibbyFormats.EBookPDFAdobe
+        format_ids = {f["id"] for f in loan["formats"]}
+        for format_id in (
+            _FORMAT_PRIORITY if prefer_open_format else _FORMAT_PRIORITY_NO_OPEN
+        ):
+            if format_id in format_ids:
+                return format_id
 
         raise ValueError("Unable to find a downloadable format")
 
@@ -615,13 +669,7 @@ class LibbyClient(object):
         :param book:
         :return:
         """
-        return bool(
-            [
-                f
-                for f in book.get("formats", [])
-                if f["id"] == LibbyFormats.EBookEPubOpen
-            ]
-        )
+        return any(f["id"] == EBOOK_EPUB_OPEN_ID for f in book.get("formats", []))
 
     @staticmethod
     def parse_datetime(value: str) -> datetime:  # type: ignore[return]
@@ -638,6 +686,16 @@ class LibbyClient(object):
             "%Y-%m-%dT%H:%M:%S.%f%z",
             "%m/%d/%Y",  # publishDateText
         )
+        if ISO_DATETIME_RE.fullmatch(value):
+            # fast path for ISO 8601 timestamps, fromisoformat() only supports
+            # the "Z" suffix from py3.11 onwards
+            try:
+                return datetime.fromisoformat(
+                    value[:-1] + "+00:00" if value.endswith("Z") else value
+                )
+            except ValueError:
+                pass
+
         for fmt in formats:
             try:
                 dt = datetime.strptime(value, fmt)
@@ -707,17 +765,21 @@ class LibbyClient(object):
             f"card/{card_id}/loan/{loan_id}/fulfill/{format_id}",
             return_res=True,
         )
+        # fulfilling can lock the loan format
+        self._sync_cache = None
         return res
 
-    @staticmethod
     def _urlretrieve(
-        endpoint: str, headers: Optional[Dict] = None, timeout: int = 15
+        self, endpoint: str, headers: Optional[Dict] = None, timeout: int = 15
     ) -> bytes:
         """
         Workaround for downloading an open (non-drm) epub or pdf.
 
         The fulfillment url 403s when using requests but
         works in curl, request.urlretrieve, etc.
+        So this uses a plain urllib3 pool manager that, like urllib, does not
+        drop any headers on the redirects, and keeps the connections to the
+        CDN alive across downloads.
 
         GET API fulfill endpoint -> 302 https://fulfill.contentreserve.com (fulfillment url)
         GET https://fulfill.contentreserve.com -> 302 https://openepub-gk.cdn.overdrive.com
@@ -741,10 +803,26 @@ class LibbyClient(object):
         if not headers:
             headers = {}
 
-        opener = request.build_opener()
-        req = request.Request(endpoint, headers=headers)
-        res = opener.open(req, timeout=timeout)
-        return res.read()
+        try:
+            res = self.cdn_pool.request(
+                "GET", endpoint, headers=headers, timeout=timeout
+            )
+        except urllib3.exceptions.TimeoutError as timeout_err:
+            raise ClientTimeoutError(str(timeout_err)) from timeout_err
+        except urllib3.exceptions.MaxRetryError as retry_err:
+            # timeouts are retried, so they usually end up here
+            if isinstance(retry_err.reason, urllib3.exceptions.TimeoutError):
+                raise ClientTimeoutError(str(retry_err)) from retry_err
+            raise ClientConnectionError(str(retry_err)) from retry_err
+        except urllib3.exceptions.HTTPError as conn_err:
+            raise ClientConnectionError(str(conn_err)) from conn_err
+        if res.status >= 400:
+            raise ClientError(
+                msg=f"{res.status} Error for url: {endpoint}",
+                http_status=res.status,
+                error_response=res.data.decode("utf-8", errors="replace"),
+            )
+        return res.data
 
     def fulfill_loan_file(self, loan_id: str, card_id: str, format_id: str) -> bytes:
         """
@@ -770,6 +848,8 @@ class LibbyClient(object):
                 return_res=True,
                 allow_redirects=False,
             )
+            # fulfilling can lock the loan format
+            self._sync_cache = None
             return self._urlretrieve(
                 res_redirect.headers["Location"], headers=headers, timeout=self.timeout
             )
@@ -779,6 +859,8 @@ class LibbyClient(object):
             headers=headers,
             return_res=True,
         )
+        # fulfilling can lock the loan format
+        self._sync_cache = None
         return res.content
 
     def open_loan(self, loan_type: str, card_id: str, title_id: str) -> Dict:
@@ -814,28 +896,69 @@ class LibbyClient(object):
 
         # Sets a needed cookie and parse the redirect HTML for meta.
         web_url = download_base + "?" + meta["message"]
-        html = self.make_request(
+        html: requests.Response = self.make_request(
             web_url,
             headers={"Accept": "*/*"},
             method="GET",
             authenticated=False,
             return_res=True,
+            stream=True,
         )
         # audio [nav/toc, spine], ebook [nav/toc, spine, manifest]
         # both in window.bData
-        regex = re.compile(r"window\.bData\s*=\s*({.*});")
-        match = regex.search(html.text)
+        # Stream the page and only keep the script block containing window.bData,
+        # the rest of the html is not needed.
+        buffer = bytearray()
+        marker_found = False
+        with html:
+            for chunk in html.iter_content(chunk_size=64 * 1024):
+                scan_from = max(0, len(buffer) - len(b"</script>"))
+                buffer.extend(chunk)
+                if not marker_found:
+                    # look for the assignment, not just any use of window.bData
+                    marker_match = BDATA_RE.search(buffer)
+                    if not marker_match:
+                        # keep the tail in case the assignment spans 2 chunks
+                        tail_pos = buffer.rfind(BDATA_MARKER)
+                        if (
+                            tail_pos < 0
+                            or buffer[tail_pos + len(BDATA_MARKER) :].strip()
+                        ):
+                            tail_pos = len(buffer) - len(BDATA_MARKER)
+                        del buffer[: max(tail_pos, 0)]
+                        continue
+                    marker_found = True
+                    del buffer[: marker_match.start()]
+                    scan_from = 0
+                if buffer.find(b"</script>", scan_from) >= 0:
+                    break
+
+        # only locate the start of the assignment and let the json decoder
+        # consume exactly one object from there instead of a greedy regex scan
+        match = BDATA_RE.match(buffer) if marker_found else None
         if not match:
             raise ValueError(f"Failed to parse window.bData for book info: {web_url}")
-        openbook = json.loads(match.group(1))
+        script_end = buffer.find(b"</script>", match.end())
+        bdata_text = buffer[
+            match.end() : script_end if script_end >= 0 else None
+        ].decode(html.encoding or "utf-8", errors="replace")
+        try:
+            try:
+                # fast path: window.bData is the last statement in its script,
+                # anything else after it makes this fail
+                openbook = json_loads(bdata_text.rstrip().rstrip(";"))
+            except ValueError:
+                openbook, _ = json.JSONDecoder().raw_decode(bdata_text)
+        except json.JSONDecodeError as err:
+            raise ValueError(
+                f"Failed to parse window.bData for book info: {web_url}"
+            ) from err
 
         # set download_base for ebook
         openbook["download_base"] = download_base
         return download_base, openbook
 
-    def process_audiobook(
-        self, loan: Dict
-    ) -> Tuple[Dict, OrderedDictType[str, PartMeta]]:
+    def process_audiobook(self, loan: Dict) -> Tuple[Dict, Dict[str, PartMeta]]:
         """
         Returns the data needed to download an audiobook.
 
@@ -867,6 +990,7 @@ class LibbyClient(object):
         self.make_request(
             f"card/{card_id}/loan/{title_id}", method="DELETE", return_res=True
         )
+        self._sync_cache = None
 
     def return_loan(self, loan: Dict) -> None:
         """
@@ -899,6 +1023,7 @@ class LibbyClient(object):
         res: Dict = self.make_request(
             f"card/{card_id}/loan/{title_id}", json_data=data, method="POST"
         )
+        self._sync_cache = None
         return res
 
     def borrow_hold(self, hold: Dict) -> Dict:
@@ -932,6 +1057,7 @@ class LibbyClient(object):
         res: Dict = self.make_request(
             f"card/{card_id}/loan/{title_id}", json_data=data, method="PUT"
         )
+        self._sync_cache = None
         return res
 
     def renew_loan(self, loan: Dict) -> Dict:
@@ -956,4 +1082,5 @@ class LibbyClient(object):
             json_data={"days_to_suspend": 0, "email_address": ""},
             method="POST",
         )
+        self._sync_cache = None
         return res
@@ -295,6 +295,26 @@ def add_common_download_arguments(parser_dl: argparse.ArgumentParser) -> None:
         action="store_true",
         help="Hide the download progress bar (e.g. during testing).",
     )
+    parser_dl.add_argument(
+        "--threads",
+        dest="threads",
+        metavar="N",
+        type=positive_int,
+        default=1,
+        help=(
+            "Number of audiobook parts to download concurrently.\n"
+            "Default 1. For audiobooks."
+        ),
+    )
+    parser_dl.add_argument(
+        "--forceremux",
+        dest="force_remux",
+        action="store_true",
+        help=(
+            "Always remux downloaded parts with ffmpeg,\n"
+            "even if no lame tag errors are detected. For audiobooks."
+        ),
+    )
 
 
 def extract_bundled_contents(
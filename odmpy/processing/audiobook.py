@@ -20,32 +20,33 @@ import argparse
 import datetime
 import json
 import logging
-import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Optional, Any, Dict, List
-from typing import OrderedDict as OrderedDictType
 
-import eyed3  # type: ignore[import]
 import requests
 from eyed3.id3 import ID3_DEFAULT_VERSION, ID3_V2_3, ID3_V2_4  # type: ignore[import]
-from requests.exceptions import HTTPError, ConnectionError
+from eyed3.mp3 import Mp3AudioFile  # type: ignore[import]
 from termcolor import colored
-from tqdm import tqdm
 
 from .shared import (
     generate_names,
     write_tags,
+    set_chapter,
     generate_cover,
-    remux_mp3,
+    download_part,
     merge_into_mp3,
     convert_to_m4b,
     create_opf,
     get_best_cover_url,
     extract_isbn,
+    remove_files,
+    progress_positions_pool,
 )
-from ..errors import OdmpyRuntimeError
+from ..constants import TOC_ELEMENT_ID
 from ..libby import USER_AGENT, merge_toc, PartMeta, LibbyFormats
 from ..overdrive import OverDriveClient
-from ..utils import slugify, plural_or_singular_noun as ps
+from ..utils import slugify, json_dump, plural_or_singular_noun as ps
 
 
 #
@@ -56,7 +57,7 @@ from ..utils import slugify, plural_or_singular_noun as ps
 def process_audiobook_loan(
     loan: Dict,
     openbook: Dict,
-    parsed_toc: OrderedDictType[str, PartMeta],
+    parsed_toc: Dict[str, PartMeta],
     session: requests.Session,
     args: argparse.Namespace,
     logger: logging.Logger,
@@ -85,22 +86,20 @@ def process_audiobook_loan(
     overdrive_media_id = loan["id"]
     sub_title = loan.get("subtitle", None)
     cover_url = get_best_cover_url(loan)
-    authors = [
-        c["name"] for c in openbook.get("creator", []) if c.get("role", "") == "author"
-    ]
-    if not authors:
-        authors = [
-            c["name"]
-            for c in openbook.get("creator", [])
-            if c.get("role", "") == "editor"
-        ]
-    if not authors:
-        authors = [c["name"] for c in openbook.get("creator", [])]
-    narrators = [
-        c["name"]
-        for c in openbook.get("creator", [])
-        if c.get("role", "") == "narrator"
-    ]
+    authors: List[str] = []
+    editors: List[str] = []
+    all_creators: List[str] = []
+    narrators: List[str] = []
+    for c in openbook.get("creator", []):
+        role = c.get("role", "")
+        all_creators.append(c["name"])
+        if role == "author":
+            authors.append(c["name"])
+        elif role == "editor":
+            editors.append(c["name"])
+        elif role == "narrator":
+            narrators.append(c["name"])
+    authors = authors or editors or all_creators
     languages: Optional[List[str]] = (
         [str(openbook.get("language"))] if openbook.get("language") else []
     )
@@ -125,26 +124,27 @@ def process_audiobook_loan(
     }
 
     download_parts: List[PartMeta] = list(parsed_toc.values())  # noqa
-    debug_meta["download_parts"] = []
-    for p in download_parts:
-        chapters = [
-            {"title": m.title, "start": m.start_second, "end": m.end_second}
-            for m in p["chapters"]
-        ]
-        debug_meta["download_parts"].append(
+    total_parts = len(download_parts)
+    if args.write_json:
+        # only needed for debug.json
+        debug_meta["download_parts"] = [
             {
                 "url": p["url"],
                 "audio-duration": p["audio-duration"],
                 "file-length": p["file-length"],
                 "spine-position": p["spine-position"],
-                "chapters": chapters,
+                "chapters": [
+                    {"title": m.title, "start": m.start_second, "end": m.end_second}
+                    for m in p["chapters"]
+                ],
             }
-        )
+            for p in download_parts
+        ]
 
     logger.info(
         f'Downloading "{colored(title, "blue", attrs=["bold"])}" '
         f'by "{colored(", ".join(authors), "blue", attrs=["bold"])}" '
-        f'in {len(download_parts)} {ps(len(download_parts), "part")}...'
+        f'in {total_parts} {ps(total_parts, "part")}...'
     )
 
     book_folder, book_filename = generate_names(
@@ -182,85 +182,78 @@ def process_audiobook_loan(
         with book_folder.joinpath("openbook.json").open("w", encoding="utf-8") as f:
             json.dump(openbook, f, indent=2)
 
-    cover_filename, cover_bytes = generate_cover(
-        book_folder=book_folder,
-        cover_url=cover_url,
-        session=session,
-        timeout=args.timeout,
-        logger=logger,
-    )
-
     keep_cover = args.always_keep_cover
     file_tracks = []
     audio_bitrate = 0
+    # same as slugify(f"{title} - Part {part_number:02d}") without redoing it per part
+    title_slug = slugify(title, allow_unicode=True)
+    part_name_prefix = f"{title_slug.rstrip('-')}-"
+    part_filenames: Dict[int, Path] = {}
+    pending_parts: List[PartMeta] = []
     for p in download_parts:
         part_number = p["spine-position"] + 1
         part_filename = book_folder.joinpath(
-            f"{slugify(f'{title} - Part {part_number:02d}', allow_unicode=True)}.mp3"
+            f"{part_name_prefix}part-{part_number:02d}.mp3"
         )
-        part_tmp_filename = part_filename.with_suffix(".part")
-        part_file_size = p["file-length"]
-        part_download_url = p["url"]
-
+        part_filenames[part_number] = part_filename
         if part_filename.exists():
             logger.warning("Already saved %s", colored(str(part_filename), "magenta"))
         else:
-            try:
-                already_downloaded_len = 0
-                if part_tmp_filename.exists():
-                    already_downloaded_len = part_tmp_filename.stat().st_size
-
-                part_download_res = session.get(
-                    part_download_url,
-                    headers={
-                        "User-Agent": USER_AGENT,
-                        "Range": (
-                            f"bytes={already_downloaded_len}-"
-                            if already_downloaded_len
-                            else None
-                        ),
-                    },
-                    timeout=args.timeout,
-                    stream=True,
-                )
-                part_download_res.raise_for_status()
-
-                with tqdm.wrapattr(
-                    part_download_res.raw,
-                    "read",
-                    total=part_file_size,
-                    initial=already_downloaded_len,
-                    desc=f"Part {part_number:2d}",
-                    disable=args.hide_progress,
-                ) as res_raw:
-                    with part_tmp_filename.open(
-                        "ab" if already_downloaded_len else "wb"
-                    ) as outfile:
-                        shutil.copyfileobj(res_raw, outfile)
-
-                # try to remux file to remove mp3 lame tag errors
-                remux_mp3(
-                    part_tmp_filename=part_tmp_filename,
-                    part_filename=part_filename,
-                    ffmpeg_loglevel=ffmpeg_loglevel,
-                    logger=logger,
-                )
-
-            except HTTPError as he:
-                if he.response is not None:
-                    logger.error(f"HTTPError: {str(he)}")
-                    logger.debug(he.response.content)
-                raise OdmpyRuntimeError("HTTP Error while downloading part file.")
-
-            except ConnectionError as ce:
-                logger.error(f"ConnectionError: {str(ce)}")
-                raise OdmpyRuntimeError("Connection Error while downloading part file.")
+            pending_parts.append(p)
+
+    # Download (and remux) the missing parts concurrently, tagging is done after.
+    # The cover is fetched on its own worker alongside the parts.
+    progress_positions = progress_positions_pool(args.threads)
+    with ThreadPoolExecutor(max_workers=args.threads + 1) as executor:
+        cover_future = executor.submit(
+            generate_cover,
+            book_folder=book_folder,
+            cover_url=cover_url,
+            session=session,
+            timeout=args.timeout,
+            logger=logger,
+        )
+        part_futures = [
+            executor.submit(
+                download_part,
+                session=session,
+                part_download_url=p["url"],
+                part_filename=part_filenames[p["spine-position"] + 1],
+                part_number=p["spine-position"] + 1,
+                part_file_size=p["file-length"],
+                headers={"User-Agent": USER_AGENT},
+                hide_progress=args.hide_progress,
+                ffmpeg_loglevel=ffmpeg_loglevel,
+                logger=logger,
+                force_remux=args.force_remux,
+                # a single part is not run through ffmpeg when merging
+                skip_remux=args.merge_output and not args.keep_mp3 and total_parts > 1,
+                timeout=args.timeout,
+                # give concurrent downloads their own progress bar lines
+                progress_positions=progress_positions,
+            )
+            for p in pending_parts
+        ]
+        try:
+            for part_future in part_futures:
+                part_future.result()
+        except Exception:
+            for part_future in part_futures:
+                part_future.cancel()
+            raise
+        cover_filename, cover_bytes = cover_future.result()
+
+    downloaded_part_numbers = {p["spine-position"] + 1 for p in pending_parts}
+    for p in download_parts:
+        part_number = p["spine-position"] + 1
+        part_filename = part_filenames[part_number]
 
+        if part_number in downloaded_part_numbers:
             # Save id3 info only on new download, ref #42
             # This also makes handling of part files consistent with merged files
             try:
                 # Fill id3 info for mp3 part
-                audiofile = eyed3.load(part_filename)
+                audiofile = Mp3AudioFile(part_filename)
                 variable_bitrate, audio_bitrate = audiofile.info.bit_rate
                 if variable_bitrate:
                     # don't use vbr
@@ -273,13 +266,17 @@ def process_audiobook_loan(
                     narrators=narrators,
                     publisher=publisher,
                     description=description,
-                    cover_bytes=cover_bytes,
+                    # parts that are deleted after merging do not need the cover,
+                    # the merged file is given it when it is tagged
+                    cover_bytes=(
+                        cover_bytes if args.keep_mp3 or not args.merge_output else None
+                    ),
                     genres=subjects,
                     languages=languages,
                     published_date=publish_date,
                     series=series,
                     part_number=part_number,
-                    total_parts=len(download_parts),
+                    total_parts=total_parts,
                     overdrive_id=overdrive_media_id,
                     isbn=extract_isbn(
                         loan.get("formats", []), [LibbyFormats.AudioBookMP3]
@@ -287,7 +284,6 @@ def process_audiobook_loan(
                     always_overwrite=args.overwrite_tags,
                     delimiter=args.tag_delimiter,
                 )
-                audiofile.tag.save(version=id3v2_version)
 
                 if (
                     args.add_chapters
@@ -301,36 +297,42 @@ def process_audiobook_loan(
                             audiofile.tag.table_of_contents.remove(f.element_id)  # type: ignore[attr-defined]
 
                     toc = audiofile.tag.table_of_contents.set(
-                        "toc".encode("ascii"),
+                        TOC_ELEMENT_ID,
                         toplevel=True,
                         ordered=True,
                         child_ids=[],
                         description="Table of Contents",
                     )
                     chapter_marks = p["chapters"]
+                    existing_chapters = {
+                        c.element_id: c for c in audiofile.tag.chapters
+                    }
+                    child_ids: List[bytes] = []
                     for i, m in enumerate(chapter_marks):
-                        title_frameset = eyed3.id3.frames.FrameSet()
-                        title_frameset.setTextFrame(eyed3.id3.frames.TITLE_FID, m.title)
-                        chap = audiofile.tag.chapters.set(
-                            f"ch{i:02d}".encode("ascii"),
+                        chap_id = f"ch{i:02d}"
+                        chap = set_chapter(
+                            audiofile.tag,
+                            existing_chapters,
+                            chap_id.encode("ascii"),
                             times=(
                                 round(m.start_second * 1000),
                                 round(m.end_second * 1000),
                             ),
-                            sub_frames=title_frameset,
-                        )
-                        toc.child_ids.append(chap.element_id)
-                        start_time = datetime.timedelta(seconds=m.start_second)
-                        end_time = datetime.timedelta(seconds=m.end_second)
-                        logger.debug(
-                            'Added chap tag => %s: %s-%s "%s" to "%s"',
-                            colored(f"ch{i:02d}", "cyan"),
-                            start_time,
-                            end_time,
-                            colored(m.title, "cyan"),
-                            colored(str(part_filename), "blue"),
+                            title=m.title,
                         )
-                    audiofile.tag.save(version=id3v2_version)
+                        child_ids.append(chap.element_id)
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug(
+                                'Added chap tag => %s: %s-%s "%s" to "%s"',
+                                colored(chap_id, "cyan"),
+                                datetime.timedelta(seconds=m.start_second),
+                                datetime.timedelta(seconds=m.end_second),
+                                colored(m.title, "cyan"),
+                                colored(str(part_filename), "blue"),
+                            )
+                    toc.child_ids = child_ids
+
+                audiofile.tag.save(version=id3v2_version)
 
             except Exception as e:  # pylint: disable=broad-except
                 logger.warning(
@@ -352,16 +354,20 @@ def process_audiobook_loan(
             ),
         )
 
-        merge_into_mp3(
-            book_filename=book_filename,
-            file_tracks=file_tracks,
-            audio_bitrate=audio_bitrate,
-            ffmpeg_loglevel=ffmpeg_loglevel,
-            hide_progress=args.hide_progress,
-            logger=logger,
-        )
+        if len(file_tracks) == 1 and not args.keep_mp3:
+            # nothing to merge, the single part becomes the book file
+            file_tracks[0]["file"].replace(book_filename)
+        else:
+            merge_into_mp3(
+                book_filename=book_filename,
+                file_tracks=file_tracks,
+                audio_bitrate=audio_bitrate,
+                ffmpeg_loglevel=ffmpeg_loglevel,
+                hide_progress=args.hide_progress,
+                logger=logger,
+            )
 
-        audiofile = eyed3.load(book_filename)
+        audiofile = Mp3AudioFile(book_filename)
         write_tags(
             audiofile=audiofile,
             title=title,
@@ -382,6 +388,10 @@ def process_audiobook_loan(
             always_overwrite=args.overwrite_tags,
             delimiter=args.tag_delimiter,
         )
+        # the merged book is a single track. An unset track_num is (None, None),
+        # so check the number itself
+        if args.overwrite_tags or not audiofile.tag.track_num[0]:
+            audiofile.tag.track_num = (1, 1)
 
         if args.add_chapters and (
             args.overwrite_tags or not audiofile.tag.table_of_contents
@@ -393,37 +403,41 @@ def process_audiobook_loan(
                     audiofile.tag.table_of_contents.remove(f.element_id)  # type: ignore[attr-defined]
 
             toc = audiofile.tag.table_of_contents.set(
-                "toc".encode("ascii"),
+                TOC_ELEMENT_ID,
                 toplevel=True,
                 ordered=True,
                 child_ids=[],
                 description="Table of Contents",
             )
             merged_markers = merge_toc(parsed_toc)
-            debug_meta["merged_markers"] = [
-                {"title": m.title, "start": m.start_second, "end": m.end_second}
-                for m in merged_markers
-            ]
-
+            if args.write_json:
+                debug_meta["merged_markers"] = [
+                    {"title": m.title, "start": m.start_second, "end": m.end_second}
+                    for m in merged_markers
+                ]
+
+            existing_chapters = {c.element_id: c for c in audiofile.tag.chapters}
+            child_ids = []
             for i, m in enumerate(merged_markers):
-                title_frameset = eyed3.id3.frames.FrameSet()
-                title_frameset.setTextFrame(eyed3.id3.frames.TITLE_FID, m.title)
-                chap = audiofile.tag.chapters.set(
-                    f"ch{i}".encode("ascii"),
+                chap_id = f"ch{i}"
+                chap = set_chapter(
+                    audiofile.tag,
+                    existing_chapters,
+                    chap_id.encode("ascii"),
                     times=(round(m.start_second * 1000), round(m.end_second * 1000)),
-                    sub_frames=title_frameset,
-                )
-                toc.child_ids.append(chap.element_id)
-                start_time = datetime.timedelta(seconds=m.start_second)
-                end_time = datetime.timedelta(seconds=m.end_second)
-                logger.debug(
-                    'Added chap tag => %s: %s-%s "%s" to "%s"',
-                    colored(f"ch{i}", "cyan"),
-                    start_time,
-                    end_time,
-                    colored(m.title, "cyan"),
-                    colored(str(book_filename), "blue"),
+                    title=m.title,
                 )
+                child_ids.append(chap.element_id)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        'Added chap tag => %s: %s-%s "%s" to "%s"',
+                        colored(chap_id, "cyan"),
+                        datetime.timedelta(seconds=m.start_second),
+                        datetime.timedelta(seconds=m.end_second),
+                        colored(m.title, "cyan"),
+                        colored(str(book_filename), "blue"),
+                    )
+            toc.child_ids = child_ids
 
         audiofile.tag.save(version=id3v2_version)
 
@@ -453,11 +467,8 @@ def process_audiobook_loan(
             )
 
         if not args.keep_mp3:
-            for file_track in file_tracks:
-                try:
-                    file_track["file"].unlink()
-                except Exception as e:  # pylint: disable=broad-except
-                    logger.warning(f'Error deleting "{file_track["file"]}": {str(e)}')
+            # only delete the parts once the book has been written successfully
+            remove_files([ft["file"] for ft in file_tracks], logger)
 
     if not keep_cover and cover_filename.exists():
         try:
@@ -469,9 +480,7 @@ def process_audiobook_loan(
         if args.merge_output:
             opf_file_path = book_filename.with_suffix(".opf")
         else:
-            opf_file_path = book_folder.joinpath(
-                f"{slugify(title, allow_unicode=True)}.opf"
-            )
+            opf_file_path = book_folder.joinpath(f"{title_slug}.opf")
         if not opf_file_path.exists():
             od_client = OverDriveClient(
                 user_agent=USER_AGENT, timeout=args.timeout, retry=args.retries
@@ -500,8 +509,12 @@ def process_audiobook_loan(
             logger.info("Already saved %s", colored(str(opf_file_path), "magenta"))
 
     if args.write_json:
-        with book_folder.joinpath("debug.json").open("w", encoding="utf-8") as outfile:
-            json.dump(debug_meta, outfile, indent=2)
+        # write to a temp file first so that an interrupted write doesn't leave a torn file
+        debug_filename = book_folder.joinpath("debug.json")
+        temp_debug_filename = debug_filename.with_suffix(".part")
+        with temp_debug_filename.open("wb") as outfile:
+            json_dump(debug_meta, outfile)
+        temp_debug_filename.replace(debug_filename)
 
     if not args.is_debug_mode:
         # clean up
@@ -509,6 +522,4 @@ def process_audiobook_loan(
             "openbook.json",
             "loan.json",
         ):
-            target = book_folder.joinpath(file_name)
-            if target.exists():
-                target.unlink()
+            book_folder.joinpath(file_name).unlink(missing_ok=True)
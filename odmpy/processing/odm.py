@@ -20,37 +20,52 @@ import argparse
 import base64
 import datetime
 import hashlib
+import io
 import json
 import logging
 import math
 import re
-import shutil
 import uuid
-import xml.etree.ElementTree as ET
 from collections import OrderedDict
-from functools import reduce
+from concurrent.futures import ThreadPoolExecutor
 from html import unescape as unescape_html
+from itertools import accumulate, chain
 from pathlib import Path
-from typing import Any, Union, Dict, List, Optional
+from typing import Any, Dict, List, NamedTuple, Optional
 
 import eyed3  # type: ignore[import]
 from eyed3.id3 import ID3_DEFAULT_VERSION, ID3_V2_3, ID3_V2_4  # type: ignore[import]
+from eyed3.mp3 import Mp3AudioFile  # type: ignore[import]
 from requests.exceptions import HTTPError, ConnectionError
 from termcolor import colored
-from tqdm import tqdm
+
+try:
+    from lxml import etree as ET  # type: ignore[import]
+except ImportError:  # pragma: no cover
+    import xml.etree.ElementTree as ET  # type: ignore[no-redef]
 
 from .shared import (
     generate_names,
     write_tags,
+    set_chapter,
+    progress_positions_pool,
     generate_cover,
-    remux_mp3,
+    download_part,
     merge_into_mp3,
     convert_to_m4b,
     create_opf,
     init_session,
 )
 from ..cli_utils import OdmpyCommands
-from ..constants import OMC, OS, UA, UNSUPPORTED_PARSER_ENTITIES, UA_LONG
+from ..constants import (
+    OMC,
+    OS,
+    UA,
+    UNSUPPORTED_PARSER_ENTITIES,
+    UA_LONG,
+    LICENSE_CHUNK_SIZE,
+    TOC_ELEMENT_ID,
+)
 from ..errors import OdmpyRuntimeError
 from ..libby import USER_AGENT
 from ..overdrive import OverDriveClient
@@ -60,20 +75,42 @@ from ..utils import (
     parse_duration_to_seconds,
     parse_duration_to_milliseconds,
     get_element_text,
+    json_dump,
     plural_or_singular_noun as ps,
 )
 
 RESERVE_ID_RE = re.compile(
     r"(?P<reserve_id>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})"
 )
+# unescaped '&' found in Metadata and OverDrive MediaMarkers text
+INVALID_AMP_RE = re.compile(r"\s&\s")
+# lxml does not accept str input that declares an encoding
+XML_DECLARATION_RE = re.compile(r"^\s*<\?xml\b[^>]*\?>")
+# constant tail of the license request hash input, pre-encoded
+LICENSE_HASH_SUFFIX = f"|{OMC}|{OS}|ELOSNOC*AIDEM*EVIRDREVO".encode("utf-16-le")
+
+
+# chapter marker for a part or merged file, times are in milliseconds
+class Marker(NamedTuple):
+    id: str
+    text: str
+    start_time: int
+    end_time: int
+
 
 #
 # Main processing logic for odm-based downloads
 #
 
 
+def _clean_xml_text(text: str) -> str:
+    # remove invalid '&' char, and the xml declaration because the text is already decoded
+    return XML_DECLARATION_RE.sub("", INVALID_AMP_RE.sub(" &amp; ", text), count=1)
+
+
 def _patch_for_parse_error(text: str) -> str:
-    # [TODO]: Find a more generic solution instead of patching entities, maybe lxml?
+    # The text can contain HTML entities that are not defined in XML, which
+    # the parser rejects, so declare them before re-parsing.
     # Ref: https://github.com/ping/odmpy/issues/19
     return "<!DOCTYPE xml [{patch}]>{text}".format(
         patch="".join(
@@ -120,16 +157,22 @@ def process_odm(
     root = xml_doc.getroot()
     overdrive_media_id = root.attrib.get("id", "")
     metadata = None
-    for t in root.itertext():
-        if not t.startswith("<Metadata>"):
-            continue
-        # remove invalid '&' char
-        text = re.sub(r"\s&\s", " &amp; ", t)
+    # the Metadata CDATA is normally a top-level text node (the tail of <License>),
+    # so check those before falling back to walking every text node in the tree
+    metadata_text = next(
+        (
+            t
+            for t in chain([root.text], (c.tail for c in root), root.itertext())
+            if t and t.startswith("<Metadata>")
+        ),
+        None,
+    )
+    if metadata_text:
+        text = _clean_xml_text(metadata_text)
         try:
             metadata = ET.fromstring(text)
         except ET.ParseError:
             metadata = ET.fromstring(_patch_for_parse_error(text))
-        break
 
     if not metadata:
         raise ValueError("Unable to find Metadata in ODM")
@@ -140,34 +183,32 @@ def process_odm(
     description = get_element_text(metadata.find("Description"))
     series = get_element_text(metadata.find("Series"))
     cover_url = get_element_text(metadata.find("CoverUrl"))
-    authors = [
-        unescape_html(get_element_text(c))
-        for c in metadata.find("Creators") or []
-        if "Author" in c.attrib.get("role", "")
-    ]
-    if not authors:
-        authors = [
-            unescape_html(get_element_text(c))
-            for c in metadata.find("Creators") or []
-            if "Editor" in c.attrib.get("role", "")
-        ]
-    if not authors:
-        authors = [
-            unescape_html(get_element_text(c))
-            for c in metadata.find("Creators") or []
-            if c.text
-        ]
-    narrators = [
-        unescape_html(get_element_text(c))
-        for c in metadata.find("Creators") or []
-        if "Narrator" in c.attrib.get("role", "")
-    ]
+    creator_eles = list(metadata.find("Creators") or [])
+    language_eles = list(metadata.find("Languages") or [])
+    authors: List[str] = []
+    editors: List[str] = []
+    named_creators: List[str] = []
+    narrators: List[str] = []
+    for c in creator_eles:
+        role = c.attrib.get("role", "")
+        creator_name = unescape_html(get_element_text(c))
+        if "Author" in role:
+            authors.append(creator_name)
+        if "Editor" in role:
+            editors.append(creator_name)
+        if "Narrator" in role:
+            narrators.append(creator_name)
+        if c.text:
+            named_creators.append(creator_name)
+    authors = authors or editors or named_creators
     languages = [
         lang.attrib.get("code", "")
-        for lang in metadata.find("Languages") or []
+        for lang in language_eles
         if lang.attrib.get("code", "")
     ]
-    subjects = [subj.text for subj in metadata.find("Subjects") or [] if subj.text]
+    subjects: List[str] = [
+        subj.text for subj in metadata.find("Subjects") or [] if subj.text
+    ]
 
     debug_meta: Dict[str, Any] = {
         "meta": {
@@ -188,10 +229,7 @@ def process_odm(
                     "Creators:",
                     colored(
                         ", ".join(
-                            [
-                                f"{c.text} ({c.attrib['role']})"
-                                for c in metadata.find("Creators") or []
-                            ]
+                            [f"{c.text} ({c.attrib['role']})" for c in creator_eles]
                         ),
                         "blue",
                     ),
@@ -200,7 +238,7 @@ def process_odm(
             logger.info(f"{'Publisher:':10} {publisher}")
             logger.info(f"{'Subjects:':10} {', '.join(subjects)}")
             logger.info(
-                f"{'Languages:':10} {', '.join([c.text for c in metadata.find('Languages') or [] if c.text])}"
+                f"{'Languages:':10} {', '.join([c.text for c in language_eles if c.text])}"
             )
             logger.info(f"{'Description:':10}\n{description}")
             for formats in root.findall("Formats"):
@@ -215,15 +253,10 @@ def process_odm(
         elif args.format == "json":
             result: Dict[str, Any] = {
                 "title": title,
-                "creators": [
-                    f"{c.text} ({c.attrib['role']})"
-                    for c in metadata.find("Creators") or []
-                ],
+                "creators": [f"{c.text} ({c.attrib['role']})" for c in creator_eles],
                 "publisher": publisher,
-                "subjects": [c.text for c in metadata.find("Subjects") or [] if c.text],
-                "languages": [
-                    c.text for c in metadata.find("Languages") or [] if c.text
-                ],
+                "subjects": subjects,
+                "languages": [c.text for c in language_eles if c.text],
                 "description": description,
                 "formats": [],
             }
@@ -257,22 +290,27 @@ def process_odm(
 
         return
 
-    session = init_session(max_retries=args.retries)
+    session = init_session(
+        max_retries=args.retries,
+        pool_maxsize=args.threads,
+        timeout=args.timeout,
+        user_agent=UA,
+    )
 
     # Download Book
-    download_baseurl = ""
-    download_parts = []
-    for formats in root.findall("Formats"):
-        for f in formats:
-            protocols = f.find("Protocols") or []
-            for p in protocols:
-                if p.attrib.get("method", "") != "download":
-                    continue
-                download_baseurl = p.attrib["baseurl"]
-                break
-            parts = f.find("Parts") or []
-            for p in parts:
-                download_parts.append(p.attrib)
+    odm_formats = [f for formats in root.findall("Formats") for f in formats]
+    download_baseurl = next(
+        (
+            p.attrib["baseurl"]
+            for f in odm_formats
+            for p in f.find("Protocols") or []
+            if p.attrib.get("method", "") == "download"
+        ),
+        "",
+    )
+    download_parts = [
+        dict(p.attrib) for f in odm_formats for p in f.find("Parts") or []
+    ]
     debug_meta["download_parts"] = download_parts
 
     logger.info(
@@ -335,16 +373,18 @@ def process_odm(
     media_id = root.attrib["id"]
 
     client_id = str(uuid.uuid1()).upper()
-    raw_hash = f"{client_id}|{OMC}|{OS}|ELOSNOC*AIDEM*EVIRDREVO"
-    m = hashlib.sha1(raw_hash.encode("utf-16-le"))
-    license_hash = base64.b64encode(m.digest())
+    m = hashlib.sha1(client_id.encode("utf-16-le"))
+    m.update(LICENSE_HASH_SUFFIX)
+    license_hash = base64.b64encode(m.digest()).decode("ascii")
 
     # Extract license:
     # License file is downloadable only once per odm,
     # so we keep it in case downloads fail
     license_file = Path(args.download_dir, odm_file.with_suffix(".license").name)
+    license_bytes = bytearray()
     if license_file.exists():
         logger.warning(f"Already downloaded license file: {license_file}")
+        license_bytes.extend(license_file.read_bytes())
     else:
         # download license file
         params = OrderedDict(
@@ -357,17 +397,12 @@ def process_odm(
             ]
         )
 
-        license_res = session.get(
-            acquisition_url,
-            params=params,
-            headers={"User-Agent": UA},
-            timeout=args.timeout,
-            stream=True,
-        )
+        license_res = session.get(acquisition_url, params=params, stream=True)
         try:
             license_res.raise_for_status()
             with license_file.open("wb") as outfile:
-                for chunk in license_res.iter_content(1024):
+                for chunk in license_res.iter_content(LICENSE_CHUNK_SIZE):
+                    license_bytes.extend(chunk)
                     outfile.write(chunk)
             logger.debug(f"Saved license file {license_file}")
 
@@ -385,12 +420,18 @@ def process_odm(
             logger.error(f"ConnectionError: {str(ce)}")
             raise OdmpyRuntimeError("Connection Error while downloading license.")
 
-    license_xml_doc = ET.parse(license_file)
-    license_root = license_xml_doc.getroot()
-
     ns = "{http://license.overdrive.com/2008/03/License.xsd}"
 
-    signed_info_ele = license_root.find(f"{ns}SignedInfo")
+    # the license is parsed and sent as a header from the same in-memory copy,
+    # and parsing stops as soon as SignedInfo is complete (Signature follows it)
+    signed_info_ele = next(
+        (
+            ele
+            for _, ele in ET.iterparse(io.BytesIO(license_bytes))
+            if ele.tag == f"{ns}SignedInfo"
+        ),
+        None,
+    )
     if signed_info_ele is None:
         raise ValueError("Unable to find SignedInfo in License")
 
@@ -398,86 +439,74 @@ def process_odm(
     if not license_client_id:
         raise ValueError("Unable to find ClientID in License.SignedInfo")
 
-    with license_file.open("r", encoding="utf-8") as lic_file:
-        lic_file_contents = lic_file.read()
+    lic_file_contents = license_bytes.decode("utf-8")
 
     track_count = 0
     file_tracks: List[Dict] = []
     keep_cover = args.always_keep_cover
     audio_lengths_ms = []
     audio_bitrate = 0
+    part_filenames: Dict[int, Path] = {}
+    pending_parts: List[Dict] = []
+    # same as slugify(f"{title} - Part {part_number:02d}") without redoing it per part
+    title_slug = slugify(title, allow_unicode=True)
+    part_name_prefix = f"{title_slug.rstrip('-')}-"
     for p in download_parts:
         part_number = int(p["number"])
         part_filename = book_folder.joinpath(
-            f"{slugify(f'{title} - Part {part_number:02d}', allow_unicode=True)}.mp3"
+            f"{part_name_prefix}part-{part_number:02d}.mp3"
         )
-        part_tmp_filename = part_filename.with_suffix(".part")
-        part_file_size = int(p["filesize"])
-        part_url_filename = p["filename"]
-        part_download_url = f"{download_baseurl}/{part_url_filename}"
-        part_markers = []
-
+        part_filenames[part_number] = part_filename
         if part_filename.exists():
             logger.warning("Already saved %s", colored(str(part_filename), "magenta"))
         else:
-            try:
-                already_downloaded_len = 0
-                if part_tmp_filename.exists():
-                    already_downloaded_len = part_tmp_filename.stat().st_size
-
-                part_download_res = session.get(
-                    part_download_url,
-                    headers={
-                        "User-Agent": UA,
-                        "ClientID": license_client_id,
-                        "License": lic_file_contents,
-                        "Range": (
-                            f"bytes={already_downloaded_len}-"
-                            if already_downloaded_len
-                            else None
-                        ),
-                    },
-                    timeout=args.timeout,
-                    stream=True,
-                )
-                part_download_res.raise_for_status()
-
-                with tqdm.wrapattr(
-                    part_download_res.raw,
-                    "read",
-                    total=part_file_size,
-                    initial=already_downloaded_len,
-                    desc=f"Part {part_number:2d}",
-                    disable=args.hide_progress,
-                ) as res_raw:
-                    with part_tmp_filename.open(
-                        "ab" if already_downloaded_len else "wb"
-                    ) as outfile:
-                        shutil.copyfileobj(res_raw, outfile)
-
-                # try to remux file to remove mp3 lame tag errors
-                remux_mp3(
-                    part_tmp_filename=part_tmp_filename,
-                    part_filename=part_filename,
-                    ffmpeg_loglevel=ffmpeg_loglevel,
-                    logger=logger,
-                )
-
-            except HTTPError as he:
-                if he.response is not None:
-                    logger.error(f"HTTPError: {str(he)}")
-                    logger.debug(he.response.content)
-                raise OdmpyRuntimeError("HTTP Error while downloading part file.")
+            pending_parts.append(p)
 
-            except ConnectionError as ce:
-                logger.error(f"ConnectionError: {str(ce)}")
-                raise OdmpyRuntimeError("Connection Error while downloading part file.")
+    # Download (and remux) the missing parts concurrently, tagging is done after
+    part_headers = {
+        "ClientID": license_client_id,
+        "License": lic_file_contents,
+    }
+    progress_positions = progress_positions_pool(args.threads)
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        part_futures = [
+            executor.submit(
+                download_part,
+                session=session,
+                part_download_url=f"{download_baseurl}/{p['filename']}",
+                part_filename=part_filenames[int(p["number"])],
+                part_number=int(p["number"]),
+                part_file_size=int(p["filesize"]),
+                headers=part_headers,
+                hide_progress=args.hide_progress,
+                ffmpeg_loglevel=ffmpeg_loglevel,
+                logger=logger,
+                force_remux=args.force_remux,
+                # give concurrent downloads their own progress bar lines
+                progress_positions=progress_positions,
+            )
+            for p in pending_parts
+        ]
+        try:
+            for part_future in part_futures:
+                part_future.result()
+        except Exception:
+            for part_future in part_futures:
+                part_future.cancel()
+            raise
+
+    downloaded_part_numbers = {int(p["number"]) for p in pending_parts}
+    for p in download_parts:
+        part_number = int(p["number"])
+        part_filename = part_filenames[part_number]
+        part_markers = []
 
+        if part_number in downloaded_part_numbers:
             # Save id3 info only on new download, ref #42
             # This also makes handling of part files consistent with merged files
             try:
                 # Fill id3 info for mp3 part
-                audiofile: eyed3.core.AudioFile = eyed3.load(part_filename)
+                audiofile: eyed3.core.AudioFile = Mp3AudioFile(part_filename)
                 _, audio_bitrate = audiofile.info.bit_rate
 
                 write_tags(
@@ -488,7 +517,11 @@ def process_odm(
                     narrators=narrators,
                     publisher=publisher,
                     description=description,
-                    cover_bytes=cover_bytes,
+                    # parts that are deleted after merging do not need the cover,
+                    # the merged file is given it when it is tagged
+                    cover_bytes=(
+                        cover_bytes if args.keep_mp3 or not args.merge_output else None
+                    ),
                     genres=subjects,
                     languages=languages,
                     published_date=None,  # odm does not contain date info
@@ -499,7 +532,6 @@ def process_odm(
                     always_overwrite=args.overwrite_tags,
                     delimiter=args.tag_delimiter,
                 )
-                audiofile.tag.save(version=id3v2_version)
 
                 # Notes: Can't switch over to using eyed3 (audiofile.info.time_secs)
                 # because it is completely off by about 10-20 seconds.
@@ -514,7 +546,7 @@ def process_odm(
                     if frame.description != "OverDrive MediaMarkers":
                         continue
                     if frame.text:
-                        frame_text = re.sub(r"\s&\s", " &amp; ", frame.text)
+                        frame_text = _clean_xml_text(frame.text)
                         try:
                             tree = ET.fromstring(frame_text)
                         except UnicodeEncodeError:
@@ -542,19 +574,19 @@ def process_odm(
                     and (args.overwrite_tags or not audiofile.tag.table_of_contents)
                 ):
                     # set the chapter marks
-                    generated_markers: List[Dict[str, Union[str, int]]] = []
+                    generated_markers: List[Marker] = []
                     for j, file_marker in enumerate(part_markers):
                         generated_markers.append(
-                            {
-                                "id": file_marker[0],
-                                "text": file_marker[1],
-                                "start_time": int(file_marker[2]),
-                                "end_time": int(
+                            Marker(
+                                file_marker[0],
+                                file_marker[1],
+                                int(file_marker[2]),
+                                int(
                                     round(audiofile.info.time_secs * 1000)
                                     if j == (len(part_markers) - 1)
                                     else part_markers[j + 1][2]
                                 ),
-                            }
+                            )
                         )
 
                     if args.overwrite_tags and audiofile.tag.table_of_contents:
@@ -564,41 +596,39 @@ def process_odm(
                             audiofile.tag.table_of_contents.remove(f.element_id)  # type: ignore[attr-defined]
 
                     toc = audiofile.tag.table_of_contents.set(
-                        "toc".encode("ascii"),
+                        TOC_ELEMENT_ID,
                         toplevel=True,
                         ordered=True,
                         child_ids=[],
                         description="Table of Contents",
                     )
 
+                    existing_chapters = {
+                        c.element_id: c for c in audiofile.tag.chapters
+                    }
+                    child_ids: List[bytes] = []
                     for gm in generated_markers:
-                        title_frameset = eyed3.id3.frames.FrameSet()
-                        title_frameset.setTextFrame(
-                            eyed3.id3.frames.TITLE_FID, str(gm["text"])
-                        )
-
-                        chap = audiofile.tag.chapters.set(
-                            str(gm["id"]).encode("ascii"),
-                            times=(gm["start_time"], gm["end_time"]),
-                            sub_frames=title_frameset,
-                        )
-                        toc.child_ids.append(chap.element_id)
-                        start_time = datetime.timedelta(
-                            milliseconds=float(gm["start_time"])
-                        )
-                        end_time = datetime.timedelta(
-                            milliseconds=float(gm["end_time"])
-                        )
-                        logger.debug(
-                            'Added chap tag => %s: %s-%s "%s" to "%s"',
-                            colored(str(gm["id"]), "cyan"),
-                            start_time,
-                            end_time,
-                            colored(str(gm["text"]), "cyan"),
-                            colored(str(part_filename), "blue"),
+                        chap = set_chapter(
+                            audiofile.tag,
+                            existing_chapters,
+                            gm.id.encode("ascii"),
+                            times=(gm.start_time, gm.end_time),
+                            title=gm.text,
                         )
+                        child_ids.append(chap.element_id)
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug(
+                                'Added chap tag => %s: %s-%s "%s" to "%s"',
+                                colored(gm.id, "cyan"),
+                                datetime.timedelta(milliseconds=gm.start_time),
+                                datetime.timedelta(milliseconds=gm.end_time),
+                                colored(gm.text, "cyan"),
+                                colored(str(part_filename), "blue"),
+                            )
+                    toc.child_ids = child_ids
 
-                    audiofile.tag.save(version=id3v2_version)
+                # tags and chapters are written to the part in a single save
+                audiofile.tag.save(version=id3v2_version)
 
             except Exception as e:  # pylint: disable=broad-except
                 logger.warning(
@@ -639,7 +669,7 @@ def process_odm(
             logger=logger,
         )
 
-        audiofile = eyed3.load(book_filename)
+        audiofile = Mp3AudioFile(book_filename)
         write_tags(
             audiofile=audiofile,
             title=title,
@@ -660,33 +690,35 @@ def process_odm(
             always_overwrite=args.overwrite_tags,
             delimiter=args.tag_delimiter,
         )
+        # the merged book is a single track. An unset track_num is (None, None),
+        # so check the number itself
+        if args.overwrite_tags or not audiofile.tag.track_num[0]:
+            audiofile.tag.track_num = (1, 1)
 
         if args.add_chapters and (
             args.overwrite_tags or not audiofile.tag.table_of_contents
         ):
-            merged_markers: List[Dict[str, Union[str, int]]] = []
+            merged_markers: List[Marker] = []
+            # track i spans track_offsets_ms[i] to track_offsets_ms[i + 1]
+            track_offsets_ms = list(accumulate(audio_lengths_ms, initial=0))
             for i, f in enumerate(file_tracks):
-                prev_tracks_len_ms = (
-                    0 if i == 0 else reduce(lambda x, y: x + y, audio_lengths_ms[0:i])
-                )
-                this_track_endtime_ms = int(
-                    reduce(lambda x, y: x + y, audio_lengths_ms[0 : i + 1])
-                )
+                prev_tracks_len_ms = track_offsets_ms[i]
+                this_track_endtime_ms = track_offsets_ms[i + 1]
                 file_markers = f["markers"]
                 for j, file_marker in enumerate(file_markers):
                     merged_markers.append(
-                        {
-                            "id": file_marker[0],
-                            "text": str(file_marker[1]),
-                            "start_time": int(file_marker[2]) + prev_tracks_len_ms,
-                            "end_time": int(
+                        Marker(
+                            file_marker[0],
+                            str(file_marker[1]),
+                            int(file_marker[2]) + prev_tracks_len_ms,
+                            int(
                                 this_track_endtime_ms
                                 if j == (len(file_markers) - 1)
                                 else file_markers[j + 1][2] + prev_tracks_len_ms
                             ),
-                        }
+                        )
                     )
-            debug_meta["merged_markers"] = merged_markers
+            debug_meta["merged_markers"] = [m._asdict() for m in merged_markers]
 
             if args.overwrite_tags and audiofile.tag.table_of_contents:
                 # Clear existing toc to prevent "There may only be one top-level table of contents.
@@ -695,32 +727,34 @@ def process_odm(
                     audiofile.tag.table_of_contents.remove(f.element_id)  # type: ignore[attr-defined]
 
             toc = audiofile.tag.table_of_contents.set(
-                "toc".encode("ascii"),
+                TOC_ELEMENT_ID,
                 toplevel=True,
                 ordered=True,
                 child_ids=[],
                 description="Table of Contents",
             )
 
-            for mm in merged_markers:  # type: Dict[str, Union[str, int]]
-                title_frameset = eyed3.id3.frames.FrameSet()
-                title_frameset.setTextFrame(eyed3.id3.frames.TITLE_FID, mm["text"])
-                chap = audiofile.tag.chapters.set(
-                    str(mm["id"]).encode("ascii"),
-                    times=(mm["start_time"], mm["end_time"]),
-                    sub_frames=title_frameset,
-                )
-                toc.child_ids.append(chap.element_id)
-                start_time = datetime.timedelta(milliseconds=float(mm["start_time"]))
-                end_time = datetime.timedelta(milliseconds=float(mm["end_time"]))
-                logger.debug(
-                    'Added chap tag => %s: %s-%s "%s" to "%s"',
-                    colored(str(mm["id"]), "cyan"),
-                    start_time,
-                    end_time,
-                    colored(str(mm["text"]), "cyan"),
-                    colored(str(book_filename), "blue"),
+            existing_chapters = {c.element_id: c for c in audiofile.tag.chapters}
+            child_ids = []
+            for mm in merged_markers:
+                chap = set_chapter(
+                    audiofile.tag,
+                    existing_chapters,
+                    mm.id.encode("ascii"),
+                    times=(mm.start_time, mm.end_time),
+                    title=mm.text,
                 )
+                child_ids.append(chap.element_id)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        'Added chap tag => %s: %s-%s "%s" to "%s"',
+                        colored(mm.id, "cyan"),
+                        datetime.timedelta(milliseconds=mm.start_time),
+                        datetime.timedelta(milliseconds=mm.end_time),
+                        colored(mm.text, "cyan"),
+                        colored(str(book_filename), "blue"),
+                    )
+            toc.child_ids = child_ids
 
         audiofile.tag.save(version=id3v2_version)
 
@@ -774,9 +808,7 @@ def process_odm(
         if args.merge_output:
             opf_file_path = book_filename.with_suffix(".opf")
         else:
-            opf_file_path = book_folder.joinpath(
-                f"{slugify(title, allow_unicode=True)}.opf"
-            )
+            opf_file_path = book_folder.joinpath(f"{title_slug}.opf")
 
         if not opf_file_path.exists():
             mobj = RESERVE_ID_RE.match(overdrive_media_id)
@@ -813,8 +845,11 @@ def process_odm(
             logger.info("Already saved %s", colored(str(opf_file_path), "magenta"))
 
     if args.write_json:
-        with debug_filename.open("w", encoding="utf-8") as outfile:
-            json.dump(debug_meta, outfile, indent=2)
+        # write to a temp file first so that an interrupted write doesn't leave a torn file
+        temp_debug_filename = debug_filename.with_suffix(".part")
+        with temp_debug_filename.open("wb") as outfile:
+            json_dump(debug_meta, outfile)
+        temp_debug_filename.replace(debug_filename)
 
 
 def process_odm_return(args: argparse.Namespace, logger: logging.Logger) -> None:
@@ -18,8 +18,12 @@
 
 import argparse
 import logging
+import os
+import queue
+import shutil
 import subprocess
 import xml.etree.ElementTree as ET
+from http import HTTPStatus
 from pathlib import Path
 from typing import Optional, Dict, List, Tuple
 from urllib.parse import urlparse
@@ -28,10 +32,17 @@ import eyed3  # type: ignore[import]
 import requests
 from eyed3.utils import art  # type: ignore[import]
 from iso639 import Lang  # type: ignore[import]
-from requests.adapters import HTTPAdapter, Retry
+from requests.adapters import HTTPAdapter, Retry, DEFAULT_POOLSIZE
+from requests.exceptions import HTTPError, ConnectionError
 from termcolor import colored
-
-from ..constants import PERFORMER_FID, LANGUAGE_FID
+from tqdm import tqdm
+
+from ..constants import (
+    PERFORMER_FID,
+    LANGUAGE_FID,
+    PART_COPY_BUFFER_SIZE,
+    MP3_HEADER_INSPECT_SIZE,
+)
 from ..errors import OdmpyRuntimeError
 from ..libby import USER_AGENT, LibbyFormats, LibbyClient
 from ..utils import slugify, sanitize_path, is_windows
@@ -42,10 +53,50 @@ from ..utils import slugify, sanitize_path, is_windows
 #
 
 
-def init_session(max_retries: int = 0) -> requests.Session:
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that applies a default timeout to requests sent without one
+    """
+
+    def __init__(self, *args, timeout: Optional[float] = None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def init_session(
+    max_retries: int = 0,
+    pool_maxsize: int = DEFAULT_POOLSIZE,
+    timeout: Optional[float] = None,
+    user_agent: Optional[str] = None,
+) -> requests.Session:
+    """
+    Create a requests session with retries and optional request defaults
+
+    :param max_retries:
+    :param pool_maxsize: Number of connections to keep per host
+    :param timeout: Default timeout for requests that do not specify one
+    :param user_agent: Default User-Agent header
+    :return:
+    """
     session = requests.Session()
-    custom_adapter = HTTPAdapter(
-        max_retries=Retry(total=max_retries, backoff_factor=0.1)
+    if user_agent:
+        session.headers["User-Agent"] = user_agent
+    custom_adapter = TimeoutHTTPAdapter(
+        timeout=timeout,
+        # keep at least as many connections per host as there are concurrent downloads
+        pool_maxsize=max(pool_maxsize, DEFAULT_POOLSIZE),
+        max_retries=Retry(
+            total=max_retries,
+            backoff_factor=0.1,
+            status_forcelist=(500, 502, 503, 504),
+            # return the last response so that raise_for_status() still applies
+            raise_on_status=False,
+        ),
     )
     for prefix in ("http://", "https://"):
         session.mount(prefix, custom_adapter)
@@ -271,6 +322,43 @@ def write_tags(
         audiofile.tag.user_text_frames.set(isbn, "ISBN")
 
 
+def set_chapter(
+    tag: eyed3.id3.Tag,
+    existing_chapters: Dict[bytes, eyed3.id3.frames.ChapterFrame],
+    element_id: bytes,
+    times: Tuple[int, int],
+    title: str,
+) -> eyed3.id3.frames.ChapterFrame:
+    """
+    Add or update a titled chapter frame. Same as ``tag.chapters.set()`` except
+    that existing chapters are looked up in existing_chapters instead of
+    scanning all the chapter frames in the tag for every chapter added.
+
+    :param tag:
+    :param existing_chapters: Chapter frames in the tag by element id, updated with new chapters
+    :param element_id:
+    :param times: Start and end milliseconds
+    :param title:
+    :return:
+    """
+    # eyed3 keeps (not copies) sub_frames, so one FrameSet per chapter
+    title_frameset = eyed3.id3.frames.FrameSet()
+    title_frameset.setTextFrame(eyed3.id3.frames.TITLE_FID, title)
+
+    chap = existing_chapters.get(element_id)
+    if chap:
+        chap.times, chap.offsets = times, (None, None)
+        chap.sub_frames = title_frameset
+        return chap
+
+    chap = eyed3.id3.frames.ChapterFrame(
+        element_id=element_id, times=times, sub_frames=title_frameset
+    )
+    tag.frame_set[eyed3.id3.frames.CHAPTER_FID] = chap
+    existing_chapters[element_id] = chap
+    return chap
+
+
 def get_best_cover_url(loan: Dict) -> Optional[str]:
     """
     Extracts the highest resolution cover image for the loan
@@ -390,6 +478,16 @@ def merge_into_mp3(
 
     # We can't directly generate a m4b here even if specified because eyed3 doesn't support m4b/mp4
     temp_book_filename = book_filename.with_suffix(".part")
+    # Use the concat demuxer instead of the concat: protocol so that each part is
+    # demuxed on its own, i.e. the per-part ID3/Xing headers are not copied into
+    # the middle of the merged audio stream. The parts' tags are not carried over
+    # either, so the merged file must be fully tagged afterwards.
+    concat_list_filename = book_filename.with_suffix(".concat.txt")
+    with concat_list_filename.open("w", encoding="utf-8") as f:
+        for ft in file_tracks:
+            escaped_path = str(Path(ft["file"]).absolute()).replace("'", "'\\''")
+            f.write(f"file '{escaped_path}'\n")
+
     cmd = [
         "ffmpeg",
         "-y",
@@ -402,8 +500,12 @@ def merge_into_mp3(
         cmd.append("-stats")
     cmd.extend(
         [
+            "-f",
+            "concat",
+            "-safe",
+            "0",
             "-i",
-            f"concat:{'|'.join([str(ft['file']) for ft in file_tracks])}",
+            str(concat_list_filename),
             "-acodec",
             "copy",
             "-vcodec",
@@ -417,7 +519,10 @@ def merge_into_mp3(
             str(temp_book_filename),
         ]
     )
-    exit_code = subprocess.call(cmd)
+    try:
+        exit_code = subprocess.call(cmd)
+    finally:
+        concat_list_filename.unlink()
     if exit_code:
         logger.error(f"ffmpeg exited with the code: {exit_code!s}")
         logger.error(f"Command: {' '.join(cmd)!s}")
@@ -500,7 +605,7 @@ def convert_to_m4b(
         logger.error(f"Command: {' '.join(cmd)!s}")
         raise OdmpyRuntimeError("ffmpeg exited with a non-zero code")
 
-    temp_book_m4b_filename.rename(book_m4b_filename)
+    temp_book_m4b_filename.replace(book_m4b_filename)
     logger.info('Merged files into "%s"', colored(str(book_m4b_filename), "magenta"))
     try:
         book_filename.unlink()
@@ -543,12 +648,264 @@ def remux_mp3(
         if exit_code:
             logger.warning(f"ffmpeg exited with the code: {exit_code!s}")
             logger.warning(f"Command: {' '.join(cmd)!s}")
-            part_tmp_filename.rename(part_filename)
+            part_tmp_filename.replace(part_filename)
         else:
             part_tmp_filename.unlink()
     except Exception as ffmpeg_ex:  # pylint: disable=broad-except
         logger.warning(f"Error executing ffmpeg: {str(ffmpeg_ex)}")
-        part_tmp_filename.rename(part_filename)
+        part_tmp_filename.replace(part_filename)
+
+
+def _lame_tag_crc(data: bytes) -> int:
+    """
+    CRC-16 (poly 0x8005, reflected) as used for the LAME tag checksum
+
+    :param data:
+    :return:
+    """
+    crc = 0
+    for b in data:
+        crc ^= b
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+def mp3_needs_remux(file_path: Path) -> bool:
+    """
+    Inspect the first audio frame of an mp3 to check if it needs to be remuxed
+    to fix lame tag errors. Returns False only when the first frame is a valid
+    Layer III header and the Xing/Info header, if present, has a valid LAME
+    tag CRC and a byte count that matches the audio size.
+
+    :param file_path:
+    :return:
+    """
+    with file_path.open("rb") as f:
+        header = f.read(10)
+        audio_start = 0
+        if len(header) == 10 and header[:3] == b"ID3":
+            # synchsafe tag size, excluding the header and optional footer
+            audio_start = (
+                10
+                + ((header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9])
+                + (10 if header[5] & 0x10 else 0)
+            )
+        f.seek(audio_start)
+        frame = f.read(MP3_HEADER_INSPECT_SIZE)
+        file_size = f.seek(0, os.SEEK_END)
+        if file_size - audio_start >= 128:
+            f.seek(-128, os.SEEK_END)
+            if f.read(3) == b"TAG":
+                file_size -= 128
+
+    if len(frame) < 4 or frame[0] != 0xFF or (frame[1] & 0xE0) != 0xE0:
+        return True
+    version = (frame[1] >> 3) & 0x03  # 0: MPEG 2.5, 1: reserved, 2: MPEG 2, 3: MPEG 1
+    layer = (frame[1] >> 1) & 0x03  # 1: Layer III
+    bitrate_index = frame[2] >> 4
+    sample_rate_index = (frame[2] >> 2) & 0x03
+    if (
+        version == 1
+        or layer != 1
+        or bitrate_index in (0, 0x0F)
+        or sample_rate_index == 0x03
+    ):
+        return True
+
+    is_mono = (frame[3] >> 6) == 0x03
+    if version == 3:
+        xing_offset = 4 + (17 if is_mono else 32)
+    else:
+        xing_offset = 4 + (9 if is_mono else 17)
+    if not frame[1] & 0x01:
+        # protected frame, a 16-bit crc comes before the side info
+        xing_offset += 2
+    if frame[xing_offset : xing_offset + 4] not in (b"Xing", b"Info"):
+        # no vbr header to be wrong about
+        return False
+
+    flags = int.from_bytes(frame[xing_offset + 4 : xing_offset + 8], "big")
+    cursor = xing_offset + 8
+    if flags & 0x01:
+        cursor += 4  # frames count
+    if flags & 0x02:
+        stream_bytes = int.from_bytes(frame[cursor : cursor + 4], "big")
+        if stream_bytes != file_size - audio_start:
+            return True
+        cursor += 4
+    if flags & 0x04:
+        cursor += 100  # toc
+    if flags & 0x08:
+        cursor += 4  # quality
+    if frame[cursor : cursor + 4] != b"LAME":
+        return False
+    crc_offset = cursor + 34
+    if len(frame) < crc_offset + 2:
+        return True
+    return _lame_tag_crc(frame[:crc_offset]) != int.from_bytes(
+        frame[crc_offset : crc_offset + 2], "big"
+    )
+
+
+def download_part(
+    session: requests.Session,
+    part_download_url: str,
+    part_filename: Path,
+    part_number: int,
+    part_file_size: int,
+    headers: Dict[str, str],
+    hide_progress: bool,
+    ffmpeg_loglevel: str,
+    logger: logging.Logger,
+    timeout: Optional[float] = None,
+    force_remux: bool = False,
+    skip_remux: bool = False,
+    progress_positions: Optional["queue.Queue[int]"] = None,
+) -> None:
+    """
+    Download an audiobook part, resuming from an existing .part file,
+    and remux it into part_filename if needed
+
+    :param session:
+    :param part_download_url:
+    :param part_filename:
+    :param part_number:
+    :param part_file_size:
+    :param headers:
+    :param hide_progress:
+    :param ffmpeg_loglevel:
+    :param logger:
+    :param timeout: Uses the session default if not specified
+    :param force_remux: Always remux even if no lame tag errors are detected
+    :param skip_remux: Don't remux because the part will only be used in a merge,
+        which already runs every part through ffmpeg. force_remux takes precedence.
+    :param progress_positions: Free progress bar lines when parts are downloaded
+        concurrently, see progress_positions_pool(). The bar takes one of them
+        and is cleared when done.
+    :return:
+    """
+    part_tmp_filename = part_filename.with_suffix(".part")
+    # holds the ETag/Last-Modified of the .part file's source, as an If-Range validator
+    part_validator_filename = part_filename.with_suffix(".part.meta")
+    try:
+        try:
+            already_downloaded_len = part_tmp_filename.stat().st_size
+        except FileNotFoundError:
+            already_downloaded_len = 0
+
+        if already_downloaded_len:
+            headers = {**headers, "Range": f"bytes={already_downloaded_len}-"}
+            try:
+                # only resume if the file on the server is unchanged
+                headers["If-Range"] = part_validator_filename.read_text(
+                    encoding="utf-8"
+                )
+            except FileNotFoundError:
+                pass
+        part_download_res = session.get(
+            part_download_url, headers=headers, timeout=timeout, stream=True
+        )
+        part_download_res.raise_for_status()
+        if (
+            already_downloaded_len
+            and part_download_res.status_code != HTTPStatus.PARTIAL_CONTENT
+        ):
+            # server ignored the range request or the file has changed, start over
+            logger.debug(
+                "Unable to resume %s: HTTP status %s",
+                part_tmp_filename,
+                part_download_res.status_code,
+            )
+            already_downloaded_len = 0
+        if not already_downloaded_len:
+            etag = part_download_res.headers.get("ETag", "")
+            # weak etags cannot be used with If-Range
+            validator = (
+                etag
+                if etag and not etag.startswith("W/")
+                else part_download_res.headers.get("Last-Modified", "")
+            )
+            if validator:
+                part_validator_filename.write_text(validator, encoding="utf-8")
+            else:
+                part_validator_filename.unlink(missing_ok=True)
+
+        progress_position = (
+            progress_positions.get() if progress_positions is not None else None
+        )
+        try:
+            with tqdm.wrapattr(
+                part_download_res.raw,
+                "read",
+                total=part_file_size,
+                initial=already_downloaded_len,
+                desc=f"Part {part_number:2d}",
+                disable=hide_progress,
+                position=progress_position,
+                leave=progress_position is None,
+            ) as res_raw:
+                with part_tmp_filename.open(
+                    "ab" if already_downloaded_len else "wb",
+                    buffering=PART_COPY_BUFFER_SIZE,
+                ) as outfile:
+                    shutil.copyfileobj(res_raw, outfile, length=PART_COPY_BUFFER_SIZE)
+        finally:
+            if progress_positions is not None and progress_position is not None:
+                # free the line for the next part
+                progress_positions.put(progress_position)
+
+        if force_remux or (not skip_remux and mp3_needs_remux(part_tmp_filename)):
+            # try to remux file to remove mp3 lame tag errors
+            remux_mp3(
+                part_tmp_filename=part_tmp_filename,
+                part_filename=part_filename,
+                ffmpeg_loglevel=ffmpeg_loglevel,
+                logger=logger,
+            )
+        else:
+            part_tmp_filename.replace(part_filename)
+        part_validator_filename.unlink(missing_ok=True)
+
+    except HTTPError as he:
+        if he.response is not None:
+            logger.error(f"HTTPError: {str(he)}")
+            logger.debug(he.response.content)
+        raise OdmpyRuntimeError("HTTP Error while downloading part file.")
+
+    except ConnectionError as ce:
+        logger.error(f"ConnectionError: {str(ce)}")
+        raise OdmpyRuntimeError("Connection Error while downloading part file.")
+
+
+def progress_positions_pool(threads: int) -> Optional["queue.Queue[int]"]:
+    """
+    Progress bar lines for download_part() when downloading with more than 1 thread
+
+    :param threads:
+    :return:
+    """
+    if threads < 2:
+        return None
+    positions: "queue.Queue[int]" = queue.Queue()
+    for position in range(threads):
+        positions.put(position)
+    return positions
+
+
+def remove_files(file_paths: List[Path], logger: logging.Logger) -> None:
+    """
+    Delete files, logging instead of raising errors
+
+    :param file_paths:
+    :param logger:
+    :return:
+    """
+    for file_path in file_paths:
+        try:
+            file_path.unlink(missing_ok=True)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f'Error deleting "{file_path}": {str(e)}')
 
 
 def extract_authors_from_openbook(openbook: Dict) -> List[str]:
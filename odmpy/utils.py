@@ -16,6 +16,7 @@
 # along with odmpy.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import json
 import os
 import platform
 import re
@@ -23,9 +24,15 @@ import unicodedata
 import xml.etree.ElementTree as ET
 from mimetypes import guess_type
 from pathlib import Path
-from typing import Optional
+from typing import Any, BinaryIO, Optional, Union
 
-from mutagen.mp3 import MP3  # type: ignore[import]
+from mutagen.mp3 import MPEGInfo  # type: ignore[import]
+
+try:
+    # optional, faster json parsing/serialisation
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
 
 #
 # Small utility type functions used across the board
@@ -53,6 +60,32 @@ MIMETYPE_MAP = {
 }
 
 
+def json_loads(text: Union[str, bytes]) -> Any:
+    """
+    Parses a json document, using orjson if it's available.
+
+    :param text:
+    :return:
+    """
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def json_dump(obj: Any, fp: BinaryIO) -> None:
+    """
+    Writes obj as indented json to a binary file object, using orjson if it's available.
+
+    :param obj:
+    :param fp:
+    :return:
+    """
+    if orjson is not None:
+        fp.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+        return
+    fp.write(json.dumps(obj, indent=2).encode("utf-8"))
+
+
 def guess_mimetype(url: str) -> Optional[str]:
     """
     Attempt to guess the mimetype for a given url
@@ -141,11 +174,13 @@ def parse_duration_to_milliseconds(text: str) -> int:
     mobj = TIMESTAMP_RE.match(text)
     if not mobj:
         raise ValueError(f"Invalid timestamp text: {text}")
-    hours = int(mobj.group("hr") or 0)
-    minutes = int(mobj.group("min") or 0)
-    seconds = int(mobj.group("sec") or 0)
-    milliseconds = int((mobj.group("ms") or "0").ljust(3, "0"))
-    return hours * 60 * 60 * 1000 + minutes * 60 * 1000 + seconds * 1000 + milliseconds
+    hr, mins, secs, ms = mobj.group("hr", "min", "sec", "ms")
+    return (
+        int(hr or 0) * 3600000
+        + int(mins) * 60000
+        + int(secs) * 1000
+        + (int(ms.ljust(3, "0")) if ms else 0)
+    )
 
 
 def parse_duration_to_seconds(text: str) -> int:
@@ -166,10 +201,15 @@ def mp3_duration_ms(filename: Path) -> int:
     # audiofile.info.time_secs
     # returns incorrect times due to its header computation
     # mutagen does not have this issue
-    audio = MP3(filename)
-    if not audio.info:
+
+    # Only the stream info is needed, so parse it directly instead of going
+    # through MP3() which also loads every ID3 frame (incl. the cover image).
+    # MPEGInfo skips over the ID3v2 header and reads just the first frames/Xing header.
+    with filename.open("rb") as f:
+        info = MPEGInfo(f)
+    if not info.length:
         raise ValueError(f"Unable to parse MP3 info from: {filename}")
-    return int(round(audio.info.length * 1000))
+    return int(round(info.length * 1000))
 
 
 # From django
@@ -4,8 +4,11 @@ import unittest
 from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
 from http import HTTPStatus
+from unittest.mock import patch
+from urllib.parse import urljoin
 
 import responses
+import urllib3
 from responses import matchers
 
 from odmpy.libby import (
@@ -16,7 +19,12 @@ from odmpy.libby import (
     parse_part_path,
     LibbyFormats,
 )
-from odmpy.libby_errors import ClientBadRequestError, ClientError
+from odmpy.libby_errors import (
+    ClientBadRequestError,
+    ClientConnectionError,
+    ClientError,
+    ClientTimeoutError,
+)
 from tests.base import BaseTestCase, is_on_ci
 
 test_logger = logging.getLogger(__name__)
@@ -226,6 +234,49 @@ class LibbyClientTests(BaseTestCase):
             merge_toc(parse_toc(base_url, toc, spine)), expected_merged_result
         )
 
+    def test_parse_toc_spine_urls(self):
+        part_name = "{AAAAAAAA-BBBB-CCCC-9999-ABCDEF123456}Fmt425-Part01.mp3"
+        toc = [{"title": "Chapter 1", "path": part_name}]
+        for base_url in (
+            "http://localhost/",
+            "http://localhost/a/b/openbook.html?c=d",
+            "http://localhost",
+        ):
+            for path in (
+                f"{part_name}?cmpt=___",
+                "a.mp3",
+                "a/b.mp3?x=1",
+                "a.mp3?x#y",
+                "a.mp3#y",
+                "a.mp3?",
+                "a.mp3;x",
+                "a//b.mp3",
+                "a/./b.mp3",
+                "a/../b.mp3",
+                "./a.mp3",
+                "/a.mp3",
+                "//otherhost/a.mp3",
+                "https://otherhost/a.mp3",
+                " a.mp3",
+                "a.mp3 ",
+                "a\tb.mp3",
+                "",
+            ):
+                with self.subTest(base_url=base_url, path=path):
+                    spine = [
+                        {
+                            "path": path,
+                            "audio-duration": 60,
+                            "-odread-spine-position": 0,
+                            "-odread-file-bytes": 1000,
+                            "-odread-original-path": part_name,
+                        }
+                    ]
+                    self.assertEqual(
+                        parse_toc(base_url, toc, spine)[part_name]["url"],
+                        urljoin(base_url, path),
+                    )
+
     def test_loans(self):
         if not self.client.get_token():
             self.skipTest("Libby not logged in.")
@@ -494,6 +545,116 @@ class LibbyClientTests(BaseTestCase):
         client = LibbyClient(logger=self.logger, identity_token=".")
         client.update_card_name(card_id, card_name)
 
+    @responses.activate
+    def test_libby_sync_cache(self):
+        hold = {"id": "123456", "type": {"id": "ebook"}, "cardId": "99999"}
+        sync_res = responses.get(
+            "https://sentry-read.svc.overdrive.com/chip/sync",
+            json={"result": "synchronized", "cards": [{}], "loans": [], "holds": []},
+        )
+        responses.post(
+            f'https://sentry-read.svc.overdrive.com/card/{hold["cardId"]}/loan/{hold["id"]}',
+            json={},
+        )
+        client = LibbyClient(logger=self.logger, identity_token=".")
+        self.assertTrue(client.is_logged_in())
+        self.assertEqual(client.get_loans(), [])
+        self.assertEqual(client.get_holds(), [])
+        self.assertEqual(sync_res.call_count, 1)
+        client.borrow_hold(hold)
+        client.get_loans()
+        self.assertEqual(sync_res.call_count, 2)
+
+        # a caller changing the cached response does not affect the next caller
+        client.sync()["loans"].append({"id": "x"})
+        self.assertEqual(client.get_loans(), [])
+        self.assertEqual(sync_res.call_count, 2)
+
+        # fulfilling a loan can lock its format
+        responses.get(
+            f'https://sentry-read.svc.overdrive.com/card/{hold["cardId"]}/loan/{hold["id"]}'
+            f"/fulfill/{LibbyFormats.EBookEPubAdobe}",
+            json={},
+        )
+        client.fulfill(hold["id"], hold["cardId"], LibbyFormats.EBookEPubAdobe)
+        client.get_loans()
+        self.assertEqual(sync_res.call_count, 3)
+
+        client = LibbyClient(logger=self.logger, identity_token=".", sync_ttl=0)
+        client.get_loans()
+        client.get_holds()
+        self.assertEqual(sync_res.call_count, 5)
+
+    @responses.activate
+    def test_libby_prepare_loan(self):
+        loan = {"id": "123456", "type": {"id": "audiobook"}, "cardId": "99999"}
+        responses.get(
+            f'https://sentry-read.svc.overdrive.com/open/audiobook/card/{loan["cardId"]}/title/{loan["id"]}',
+            json={"urls": {"web": "http://localhost/mock"}, "message": "xyz"},
+        )
+        bdata = (
+            '{"spine": [], "nav": {"toc": [{"title": "};"}]}};window.other = {"a": 1};'
+        )
+        pages = {
+            # window.bData is the only statement in the script
+            "single statement": "<html><head><script>window.bData = "
+            + bdata[: bdata.index(";window.other")]
+            + "; \n",
+            # pad the page so that the marker spans 2 streamed chunks
+            "marker across chunks": "<html><head><script>".ljust(64 * 1024 - 4)
+            + "window.bData = "
+            + bdata,
+            # a use of window.bData that is not the assignment comes first
+            "non-assignment use": (
+                "<html><head><script>if (window.bData) {}</script><script>"
+            ).ljust(64 * 1024 - 13)
+            + "window.bData  \n = "
+            + bdata,
+        }
+        client = LibbyClient(logger=self.logger, identity_token=".")
+        for name, page in pages.items():
+            with self.subTest(page=name):
+                responses.get(
+                    "http://localhost/mock?xyz",
+                    body=page + "</script></head><body></body></html>",
+                )
+                download_base, openbook = client.prepare_loan(loan)
+                self.assertEqual(download_base, "http://localhost/mock")
+                self.assertEqual(
+                    openbook,
+                    {
+                        "spine": [],
+                        "nav": {"toc": [{"title": "};"}]},
+                        "download_base": "http://localhost/mock",
+                    },
+                )
+
+    def test_libby_urlretrieve_errors(self):
+        url = "https://openepub-gk.cdn.overdrive.com/9999990"
+        client = LibbyClient(logger=self.logger, identity_token=".")
+        for err, expected_error in (
+            (
+                urllib3.exceptions.ReadTimeoutError(None, url, "timed out"),
+                ClientTimeoutError,
+            ),
+            (
+                urllib3.exceptions.MaxRetryError(
+                    None, url, urllib3.exceptions.ConnectTimeoutError("timed out")
+                ),
+                ClientTimeoutError,
+            ),
+            (
+                urllib3.exceptions.MaxRetryError(
+                    None, url, urllib3.exceptions.ProtocolError("reset")
+                ),
+                ClientConnectionError,
+            ),
+        ):
+            with self.subTest(err=err), patch(
+                "urllib3.PoolManager.request", side_effect=err
+            ), self.assertRaises(expected_error):
+                client._urlretrieve(url)  # pylint: disable=protected-access
+
     def test_libby_auth_form(self):
         client = LibbyClient(logger=self.logger, identity_token=".")
         for website_id in ("243",):
@@ -679,7 +840,36 @@ class LibbyClientTests(BaseTestCase):
             "05/30/2023",
         ):
             with self.subTest(value=value):
-                LibbyClient.parse_datetime(value)
+                self.assertIsNotNone(LibbyClient.parse_datetime(value).tzinfo)
 
-        with self.assertRaises(ValueError):
-            LibbyClient.parse_datetime("2023/05/30 23:01:14")
+        self.assertEqual(
+            LibbyClient.parse_datetime("2023-08-10T23:00:01.000Z"),
+            datetime(2023, 8, 10, 23, 0, 1, tzinfo=timezone.utc),
+        )
+        self.assertEqual(
+            LibbyClient.parse_datetime("2023-09-14T07:20:30+08:00"),
+            datetime(2023, 9, 13, 23, 20, 30, tzinfo=timezone.utc),
+        )
+
+        # not in the fast path's format, but parsed by strptime
+        for value, expected in (
+            (
+                "2023-08-10T23:00:01.5Z",
+                datetime(2023, 8, 10, 23, 0, 1, 500000, tzinfo=timezone.utc),
+            ),
+            (
+                "2023-09-14T07:20:30+0800",
+                datetime(2023, 9, 13, 23, 20, 30, tzinfo=timezone.utc),
+            ),
+        ):
+            with self.subTest(value=value):
+                self.assertEqual(LibbyClient.parse_datetime(value), expected)
+
+        for value in (
+            "2023/05/30 23:01:14",
+            "2023-08-10T23:00:01",  # no timezone
+            "2023-08-10T23:00Z",  # no seconds
+            "2023-08-10 23:00:01Z",
+        ):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                LibbyClient.parse_datetime(value)
@@ -6,6 +6,7 @@ import responses
 from mutagen.mp3 import MP3
 
 from odmpy.odm import run
+from odmpy.processing.odm import ET, _clean_xml_text, _patch_for_parse_error
 from .base import BaseTestCase
 from .data import (
     part_title_formats,
@@ -97,6 +98,45 @@ class OdmpyDlTests(BaseTestCase):
                     self.assertEqual(audio_file.tags["TLAN"].text[0], "eng")
         self.assertTrue(expected_result.book_folder.joinpath("cover.jpg").exists())
 
+    @responses.activate
+    def test_download_threads(self):
+        """
+        `odmpy dl test.odm --threads 3`
+        """
+        for test_odm_file in self.test_odms:
+            # clear remnant downloads
+            if self.test_downloads_dir.exists():
+                shutil.rmtree(self.test_downloads_dir, ignore_errors=True)
+
+            with self.subTest(odm=test_odm_file):
+                expected_result = get_expected_result(
+                    self.test_downloads_dir, test_odm_file
+                )
+                self._setup_common_responses()
+
+                run(
+                    [
+                        "--noversioncheck",
+                        "dl",
+                        str(self.test_data_dir.joinpath(test_odm_file)),
+                        "--downloaddir",
+                        str(self.test_downloads_dir),
+                        "--threads",
+                        "3",
+                        "--hideprogress",
+                    ],
+                    be_quiet=True,
+                )
+                for i in range(1, expected_result.total_parts + 1):
+                    book_file = expected_result.book_folder.joinpath(
+                        expected_result.mp3_name_format.format(i)
+                    )
+                    self.assertTrue(book_file.exists())
+                    self.assertFalse(book_file.with_suffix(".part").exists())
+                    audio_file = MP3(book_file)
+                    self.assertTrue(audio_file.tags)
+                    self.assertEqual(audio_file.tags["TLAN"].text[0], "eng")
+
     @responses.activate
     def test_add_chapters(self):
         """
@@ -165,6 +205,22 @@ class OdmpyDlTests(BaseTestCase):
                             markers[test_odm_file][j + i - 1],
                         )
 
+    def test_parse_markers_text(self):
+        markers_text = (
+            "<Markers><Marker><Name>Caf&eacute; & Bar</Name>"
+            "<Time>0:00.000</Time></Marker></Markers>"
+        )
+        for text in (
+            markers_text,
+            f'<?xml version="1.0" encoding="utf-8" ?>{markers_text}',
+        ):
+            with self.subTest(text=text):
+                text = _clean_xml_text(text)
+                with self.assertRaises(ET.ParseError):
+                    ET.fromstring(text)
+                tree = ET.fromstring(_patch_for_parse_error(text))
+                self.assertEqual(tree.find("Marker").find("Name").text, "Café & Bar")
+
     @responses.activate
     def test_merge_formats(self):
         """
@@ -296,6 +352,8 @@ class OdmpyDlTests(BaseTestCase):
                 ]:
                     with self.subTest(tag=tag):
                         self.assertTrue(meta["format"]["tags"].get(tag))
+                # the cover is only written once, by the merged file's tags
+                self.assertEqual(len(MP3(mp3_file).tags.getall("APIC")), 1)
 
                 run(
                     [
@@ -628,8 +628,8 @@ class OdmpyLibbyTests(BaseTestCase):
             self.assertTrue(self.test_downloads_dir.joinpath(test_folder, f).exists())
 
     @responses.activate
-    @patch("urllib.request.OpenerDirector.open")
-    def test_mock_libby_download_ebook_open(self, mock_opener):
+    @patch("urllib3.PoolManager.request")
+    def test_mock_libby_download_ebook_open(self, mock_request):
         settings_folder = self._generate_fake_settings()
         with self.test_data_dir.joinpath("ebook", "sync.json").open(
             "r", encoding="utf-8"
@@ -643,10 +643,10 @@ class OdmpyLibbyTests(BaseTestCase):
             headers={"Location": "https://openepub-gk.cdn.overdrive.com/9999990"},
         )
         with self.test_data_dir.joinpath("ebook", "dummy.epub").open("rb") as a:
-            opener_open = MagicMock()
-            opener_open.getcode.return_value = 200
-            opener_open.read.return_value = a.read()
-            mock_opener.return_value = opener_open
+            cdn_res = MagicMock()
+            cdn_res.status = 200
+            cdn_res.data = a.read()
+            mock_request.return_value = cdn_res
 
             test_folder = "test"
 
@@ -963,6 +963,7 @@ class OdmpyLibbyTests(BaseTestCase):
             audio_file.tags["TXXX:ISBN"].text[0],
             [f for f in loan["formats"] if f.get("isbn")][0]["isbn"],
         )
+        self.assertEqual(len(audio_file.tags.getall("APIC")), 1)
         self.assertTrue(audio_file.tags["CTOC:toc"])
         chapters = [t for t in audio_file.tags.getall("CHAP")]
         self.assertEqual(len(markers), len(chapters))
@@ -1,6 +1,17 @@
 import argparse
+import contextlib
+import shutil
 from functools import cmp_to_key
+from http import HTTPStatus
+from unittest.mock import patch
 
+import requests
+import responses
+from eyed3.mp3 import Mp3AudioFile  # type: ignore[import]
+from mutagen.id3 import ID3
+from responses import matchers
+
+from odmpy.errors import OdmpyRuntimeError
 from odmpy.processing import shared
 from odmpy.processing.ebook import _sort_title_contents
 from tests.base import BaseTestCase
@@ -141,3 +152,204 @@ class ProcessingSharedTests(BaseTestCase):
                 {"url": "http://localhost/assets/4.css"},
             ],
         )
+
+    def test_mp3_needs_remux(self):
+        test_mp3 = self.test_data_dir.joinpath("audiobook", "book.mp3")
+        self.assertFalse(shared.mp3_needs_remux(test_mp3))
+
+        mp3_bytes = test_mp3.read_bytes()
+        lame_crc_offset = mp3_bytes.index(b"LAME") + 34
+        test_file = self.test_downloads_dir.joinpath("bad_crc.mp3")
+        test_file.write_bytes(
+            mp3_bytes[:lame_crc_offset] + b"\x00\x00" + mp3_bytes[lame_crc_offset + 2 :]
+        )
+        self.assertTrue(shared.mp3_needs_remux(test_file))
+
+        test_file = self.test_downloads_dir.joinpath("truncated.mp3")
+        test_file.write_bytes(mp3_bytes[:-1024])
+        self.assertTrue(shared.mp3_needs_remux(test_file))
+
+        test_file = self.test_downloads_dir.joinpath("not_mp3.mp3")
+        test_file.write_bytes(b"\x00" * 1024)
+        self.assertTrue(shared.mp3_needs_remux(test_file))
+
+        # truncated in the frame header, and in the lame tag before the crc
+        audio_start = ID3(test_mp3).size
+        for truncate_at in (audio_start + 2, lame_crc_offset):
+            with self.subTest(truncate_at=truncate_at):
+                test_file = self.test_downloads_dir.joinpath("truncated_header.mp3")
+                test_file.write_bytes(mp3_bytes[:truncate_at])
+                self.assertTrue(shared.mp3_needs_remux(test_file))
+
+        # Info header without a lame tag, so there is no crc to check
+        test_file = self.test_downloads_dir.joinpath("no_lame_tag.mp3")
+        test_file.write_bytes(
+            mp3_bytes[: lame_crc_offset - 34]
+            + b"\x00" * 36
+            + mp3_bytes[lame_crc_offset + 2 :]
+        )
+        self.assertFalse(shared.mp3_needs_remux(test_file))
+
+    def test_mp3_needs_remux_vbr(self):
+        # MPEG 1 stereo vbr file from ffmpeg, with a Xing header that has
+        # all the optional fields but not a lame tag (ffmpeg writes "Lavc" instead)
+        test_mp3 = self.test_data_dir.joinpath("audiobook", "vbr.mp3")
+        self.assertFalse(shared.mp3_needs_remux(test_mp3))
+
+        mp3_bytes = test_mp3.read_bytes()
+        xing_offset = mp3_bytes.index(b"Xing")
+        self.assertNotIn(b"LAME", mp3_bytes[xing_offset : xing_offset + 160])
+        # stream bytes no longer match the file
+        test_file = self.test_downloads_dir.joinpath("vbr_extra_bytes.mp3")
+        test_file.write_bytes(mp3_bytes + mp3_bytes[ID3(test_mp3).size :])
+        self.assertTrue(shared.mp3_needs_remux(test_file))
+
+    @staticmethod
+    def _protect_first_frame(mp3_bytes: bytes, audio_start: int) -> bytes:
+        # clear the protection bit and insert a (dummy) 16-bit frame crc
+        return (
+            mp3_bytes[: audio_start + 1]
+            + bytes([mp3_bytes[audio_start + 1] & 0xFE])
+            + mp3_bytes[audio_start + 2 : audio_start + 4]
+            + b"\x00\x00"
+            + mp3_bytes[audio_start + 4 :]
+        )
+
+    def test_mp3_needs_remux_protected(self):
+        # the lame tag crc and byte count no longer match after the frame crc is added
+        test_mp3 = self.test_data_dir.joinpath("audiobook", "book.mp3")
+        test_file = self.test_downloads_dir.joinpath("protected.mp3")
+        test_file.write_bytes(
+            self._protect_first_frame(test_mp3.read_bytes(), ID3(test_mp3).size)
+        )
+        self.assertTrue(shared.mp3_needs_remux(test_file))
+
+        # Xing header with the byte count updated for the frame crc
+        test_mp3 = self.test_data_dir.joinpath("audiobook", "vbr.mp3")
+        mp3_bytes = self._protect_first_frame(test_mp3.read_bytes(), ID3(test_mp3).size)
+        bytes_offset = mp3_bytes.index(b"Xing") + 12
+        stream_bytes = int.from_bytes(mp3_bytes[bytes_offset : bytes_offset + 4], "big")
+        test_file = self.test_downloads_dir.joinpath("protected_vbr.mp3")
+        test_file.write_bytes(
+            mp3_bytes[:bytes_offset]
+            + (stream_bytes + 2).to_bytes(4, "big")
+            + mp3_bytes[bytes_offset + 4 :]
+        )
+        self.assertFalse(shared.mp3_needs_remux(test_file))
+        # and not updated
+        test_file.write_bytes(mp3_bytes)
+        self.assertTrue(shared.mp3_needs_remux(test_file))
+
+    @responses.activate
+    def test_download_part_resume(self):
+        mp3_bytes = self.test_data_dir.joinpath("audiobook", "book.mp3").read_bytes()
+        part_url = "http://localhost/part-01.mp3"
+        part_filename = self.test_downloads_dir.joinpath("part-01.mp3")
+        part_validator_filename = part_filename.with_suffix(".part.meta")
+        resume_from = 1024
+        for status, resumed, validator in (
+            (HTTPStatus.PARTIAL_CONTENT, True, ""),
+            (HTTPStatus.PARTIAL_CONTENT, True, '"abc"'),
+            # server does not support range requests
+            (HTTPStatus.OK, False, ""),
+            # file on the server has changed
+            (HTTPStatus.OK, False, '"xyz"'),
+        ):
+            with self.subTest(status=status, validator=validator):
+                responses.reset()
+                expected_headers = {"Range": f"bytes={resume_from}-"}
+                if validator:
+                    expected_headers["If-Range"] = validator
+                    part_validator_filename.write_text(validator, encoding="utf-8")
+                responses.get(
+                    part_url,
+                    body=mp3_bytes[resume_from:] if resumed else mp3_bytes,
+                    status=status,
+                    headers={"ETag": '"abc"'},
+                    match=[matchers.header_matcher(expected_headers)],
+                )
+                part_filename.unlink(missing_ok=True)
+                part_filename.with_suffix(".part").write_bytes(
+                    mp3_bytes[:resume_from] if resumed else b"\x00" * resume_from
+                )
+                with requests.Session() as session:
+                    shared.download_part(
+                        session=session,
+                        part_download_url=part_url,
+                        part_filename=part_filename,
+                        part_number=1,
+                        part_file_size=len(mp3_bytes),
+                        headers={},
+                        hide_progress=True,
+                        ffmpeg_loglevel="fatal",
+                        logger=self.logger,
+                    )
+                self.assertEqual(part_filename.read_bytes(), mp3_bytes)
+                self.assertFalse(part_filename.with_suffix(".part").exists())
+                self.assertFalse(part_validator_filename.exists())
+
+    @responses.activate
+    def test_download_part_progress_positions(self):
+        self.assertIsNone(shared.progress_positions_pool(1))
+        progress_positions = shared.progress_positions_pool(2)
+        assert progress_positions is not None
+        mp3_bytes = self.test_data_dir.joinpath("audiobook", "book.mp3").read_bytes()
+        part_url = "http://localhost/part-01.mp3"
+        part_filename = self.test_downloads_dir.joinpath("part-01.mp3")
+        responses.get(part_url, body=mp3_bytes)
+        for copy_error in (None, requests.ConnectionError()):
+            with self.subTest(copy_error=copy_error):
+                part_filename.unlink(missing_ok=True)
+                with requests.Session() as session, patch.object(
+                    shared.shutil,
+                    "copyfileobj",
+                    side_effect=copy_error,
+                    wraps=shutil.copyfileobj,
+                ), self.assertRaises(
+                    OdmpyRuntimeError
+                ) if copy_error else contextlib.nullcontext():
+                    shared.download_part(
+                        session=session,
+                        part_download_url=part_url,
+                        part_filename=part_filename,
+                        part_number=1,
+                        part_file_size=len(mp3_bytes),
+                        headers={},
+                        hide_progress=True,
+                        ffmpeg_loglevel="fatal",
+                        logger=self.logger,
+                        progress_positions=progress_positions,
+                    )
+                # the progress bar lines are all free again
+                self.assertEqual(progress_positions.qsize(), 2)
+
+    def test_remove_files(self):
+        file_paths = [self.test_downloads_dir.joinpath(f"{i}.mp3") for i in range(3)]
+        for file_path in file_paths[:2]:
+            file_path.write_bytes(b"")
+        shared.remove_files(file_paths, self.logger)
+        for file_path in file_paths:
+            self.assertFalse(file_path.exists())
+
+    def test_set_chapter(self):
+        test_file = self.test_downloads_dir.joinpath("chapters.mp3")
+        shutil.copy(self.test_data_dir.joinpath("audiobook", "book.mp3"), test_file)
+        audiofile = Mp3AudioFile(test_file)
+        audiofile.tag.chapters.set(b"ch00", times=(0, 1))
+        existing_chapters = {c.element_id: c for c in audiofile.tag.chapters}
+        for i in range(3):
+            shared.set_chapter(
+                audiofile.tag,
+                existing_chapters,
+                f"ch{i:02d}".encode("ascii"),
+                times=(i * 1000, (i + 1) * 1000),
+                title=f"Chapter {i}",
+            )
+        audiofile.tag.save()
+
+        audiofile = Mp3AudioFile(test_file)
+        chapters = list(audiofile.tag.chapters)
+        self.assertEqual([c.element_id for c in chapters], [b"ch00", b"ch01", b"ch02"])
+        for i, c in enumerate(chapters):
+            self.assertEqual(tuple(c.times), (i * 1000, (i + 1) * 1000))
+            self.assertEqual(c.title, f"Chapter {i}")
@@ -2,9 +2,12 @@ import argparse
 import string
 import unittest
 from datetime import datetime
+from io import BytesIO
 from pathlib import Path
 from random import choices
 
+from mutagen.mp3 import MP3  # type: ignore[import]
+
 from odmpy import cli_utils
 from odmpy import utils
 from tests.base import is_windows
@@ -75,12 +78,49 @@ class UtilsTests(unittest.TestCase):
             "abc-def-ghi",
         )
 
+    def test_json_loads(self):
+        for text in (
+            '{"a": [1, 2.5, "x"], "b": null}',
+            b'{"a": [1, 2.5, "x"], "b": null}',
+        ):
+            with self.subTest(text=text):
+                self.assertEqual(
+                    utils.json_loads(text), {"a": [1, 2.5, "x"], "b": None}
+                )
+        with self.assertRaises(ValueError):
+            utils.json_loads('{"a": 1};')
+
+    def test_json_dump(self):
+        obj = {"a": [1, 2.5, "é"], "b": None, "c": ("x", 1)}
+        buf = BytesIO()
+        utils.json_dump(obj, buf)
+        self.assertEqual(
+            utils.json_loads(buf.getvalue()),
+            {"a": [1, 2.5, "é"], "b": None, "c": ["x", 1]},
+        )
+        self.assertIn(b'\n  "a": [', buf.getvalue())
+
     def test_parse_duration_to_milliseconds(self):
         self.assertEqual(
             utils.parse_duration_to_milliseconds("1:23:45.678"),
             1 * 60 * 60 * 1000 + 23 * 60 * 1000 + 45 * 1000 + 678,
         )
         self.assertEqual(utils.parse_duration_to_milliseconds("12:00"), 12 * 60 * 1000)
+        self.assertEqual(
+            utils.parse_duration_to_milliseconds("60:15.5"),
+            60 * 60 * 1000 + 15 * 1000 + 500,
+        )
+        with self.assertRaises(ValueError):
+            utils.parse_duration_to_milliseconds("12:00:")
+
+    def test_mp3_duration_ms(self):
+        test_mp3 = Path(__file__).parent.joinpath(
+            "data", "audiobook", "odm", "book1", "ceremonies_herrick_cjph_64kb.mp3"
+        )
+        self.assertEqual(
+            utils.mp3_duration_ms(test_mp3),
+            int(round(MP3(test_mp3).info.length * 1000)),
+        )
 
     def test_parse_duration_to_seconds(self):
         self.assertEqual(utils.parse_duration_to_seconds("12:00"), 12 * 60)